@@ -0,0 +1,81 @@
+"""Micro-benchmark of the auth_state compression.
+
+Compares the size of a large auth_state, and the latency of storing it
+(compress and Fernet encrypt, as JupyterHub does on login) and of loading it
+(Fernet decrypt and decompress, as pre_spawn_start does), with and without
+the auth_state_compression_threshold.
+
+Usage: python benchmarks/bench_auth_state_compression.py [number]
+"""
+
+import json
+import sys
+import time
+from cryptography.fernet import Fernet
+from jhubauthenticators import HeaderAuthenticator
+from jhubauthenticators._compression import compress_value
+
+THRESHOLD = 1024
+
+
+def auth_state():
+    return {
+        "Mail": "user@example.org",
+        "JsonData": {
+            "sub": "my-username",
+            "groups": ["group-{}".format(index) for index in range(200)],
+            "entitlements": [
+                "urn:example:entitlement:{}".format(index) for index in range(200)
+            ],
+        },
+    }
+
+
+def timed(operation, number):
+    return min(_timed(operation, number) for _ in range(3))
+
+
+def _timed(operation, number):
+    start = time.perf_counter()
+    for _ in range(number):
+        operation()
+    return (time.perf_counter() - start) / number
+
+
+def main(number=2000):
+    state = auth_state()
+    fernet = Fernet(Fernet.generate_key())
+
+    def store(threshold):
+        if threshold:
+            stored = {
+                key: compress_value(value, threshold) for key, value in state.items()
+            }
+        else:
+            stored = state
+        return fernet.encrypt(json.dumps(stored).encode("utf8"))
+
+    def load(encrypted):
+        return HeaderAuthenticator.decompress_auth_state(
+            json.loads(fernet.decrypt(encrypted))
+        )
+
+    print("iterations: {}".format(number))
+    for name, threshold in (("uncompressed", 0), ("compressed", THRESHOLD)):
+        encrypted = store(threshold)
+        assert load(encrypted) == state
+        store_time = timed(lambda: store(threshold), number)
+        load_time = timed(lambda: load(encrypted), number)
+        print(
+            "{:<13} encrypted auth_state {:>6} bytes, store {:.2f}us, "
+            "load {:.2f}us".format(
+                name, len(encrypted), store_time * 1e6, load_time * 1e6
+            )
+        )
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        main(int(sys.argv[1]))
+    else:
+        main()
@@ -0,0 +1,87 @@
+"""Micro-benchmark of the JSONParser projection.
+
+Parses an OIDC-style claims payload with and without a projection of the
+fields that are used, and measures the size of the resulting auth_state and
+the cost of the Fernet encrypt and decrypt that JupyterHub applies to the
+auth_state on every login and spawn.
+
+Usage: python benchmarks/bench_json_projection.py [number]
+"""
+
+import json
+import sys
+import time
+from cryptography.fernet import Fernet
+from traitlets.config import Config
+from jhubauthenticators import JSONParser
+
+PROJECTION = ["sub", "/groups", "/claims/email"]
+
+
+def claims_payload():
+    return json.dumps(
+        {
+            "sub": "my-username",
+            "groups": ["group-{}".format(index) for index in range(20)],
+            "claims": {
+                "email": "user@example.org",
+                "name": "My User",
+                "entitlements": [
+                    "urn:example:entitlement:{}".format(index) for index in range(100)
+                ],
+            },
+            "idp": {"issuer": "https://idp.example.org", "keys": ["k" * 64] * 10},
+            "session": {"id": "s" * 128, "acr": "urn:example:acr", "amr": ["pwd"]},
+        }
+    )
+
+
+def new_parser(projection):
+    config = Config()
+    config.JSONParser.projection = projection
+    return JSONParser(config=config)
+
+
+def timed(operation, number):
+    start = time.perf_counter()
+    for _ in range(number):
+        operation()
+    return (time.perf_counter() - start) / number
+
+
+def main(number=5000):
+    payload = claims_payload()
+    fernet = Fernet(Fernet.generate_key())
+    print("payload: {} bytes, iterations: {}".format(len(payload), number))
+    for name, projection in (("full", []), ("projected", PROJECTION)):
+        parser = new_parser(projection)
+        auth_state = parser.parse(payload)
+        encoded = json.dumps(auth_state).encode("utf8")
+        encrypted = fernet.encrypt(encoded)
+        parse_time = min(timed(lambda: parser.parse(payload), number) for _ in range(3))
+        encrypt_time = min(
+            timed(lambda: fernet.encrypt(json.dumps(auth_state).encode("utf8")), number)
+            for _ in range(3)
+        )
+        decrypt_time = min(
+            timed(lambda: json.loads(fernet.decrypt(encrypted)), number)
+            for _ in range(3)
+        )
+        print(
+            "{:<10} auth_state {:>6} bytes, encrypted {:>6} bytes, parse {:.2f}us, "
+            "encrypt {:.2f}us, decrypt {:.2f}us".format(
+                name,
+                len(encoded),
+                len(encrypted),
+                parse_time * 1e6,
+                encrypt_time * 1e6,
+                decrypt_time * 1e6,
+            )
+        )
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        main(int(sys.argv[1]))
+    else:
+        main()
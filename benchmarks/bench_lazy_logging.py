@@ -0,0 +1,110 @@
+"""Micro-benchmark of the per-login logging cost in HeaderAuthenticator.
+
+Times the shipped HeaderAuthenticator.authenticate, which logs lazily, with
+quiet_login_log disabled and enabled, against the previous authenticate,
+which is copied below with its eager "...".format(...) log calls. DEBUG is
+disabled and INFO is written to a discarding stream handler. The shipped
+authenticate also includes the metrics of the login path.
+
+Usage: python benchmarks/bench_lazy_logging.py [number]
+"""
+
+import asyncio
+import io
+import json
+import logging
+import sys
+import time
+from tornado import web
+from traitlets.config import Config
+from jhubauthenticators import HeaderAuthenticator, Parser, JSONParser
+
+
+async def eager_authenticate(self, handler, data):
+    self.log.debug(
+        "HeaderAuthenticator - Request authentication with "
+        "handler: {}, data: {} of type: {}".format(handler, data, type(data))
+    )
+    self.log.debug(
+        "HeaderAuthenticator allowed headers: {}".format(self.allowed_headers)
+    )
+    user_data = {}
+    for allowed_index, allowed_value in self.allowed_headers.items():
+        auth_data = data.get(allowed_value, "")
+        if auth_data:
+            prepared_data = None
+            if allowed_index in self.header_parsers:
+                prepared_data = self.header_parsers[allowed_index].parse(auth_data)
+            else:
+                prepared_data = data
+            if prepared_data:
+                user_data[allowed_value] = prepared_data
+    self.log.debug(
+        "HeaderAuthenticator - Prepared user_data: {} "
+        "for auth check".format(user_data)
+    )
+    if self.allowed_headers["auth"] not in user_data:
+        raise web.HTTPError(401)
+    user = {"name": user_data.pop(self.allowed_headers["auth"], None)}
+    if user_data:
+        user.update({"auth_state": user_data})
+    self.log.info("Authenticated: {} - Login".format(user))
+    return user
+
+
+def timed(authenticate, authenticator, data, number):
+    async def run():
+        start = time.perf_counter()
+        for _ in range(number):
+            await authenticate(authenticator, None, data)
+        return time.perf_counter() - start
+
+    return min(asyncio.run(run()) for _ in range(5))
+
+
+def main(number=20000):
+    log = logging.getLogger("bench_lazy_logging")
+    log.propagate = False
+    log.addHandler(logging.StreamHandler(io.StringIO()))
+    log.setLevel(logging.INFO)
+
+    config = Config()
+    config.HeaderAuthenticator.allowed_headers = {
+        "auth": "Remote-User",
+        "jsondata": "JsonData",
+    }
+    config.HeaderAuthenticator.header_parser_classes = {
+        "auth": Parser,
+        "jsondata": JSONParser,
+    }
+    authenticator = HeaderAuthenticator(config=config, log=log)
+
+    claims = {"groups": ["group-{}".format(i) for i in range(50)], "sub": "x" * 64}
+    data = {"Remote-User": "my-username", "JsonData": json.dumps(claims)}
+    user = {"name": "my-username", "auth_state": {"JsonData": claims}}
+    assert asyncio.run(authenticator.authenticate(None, data)) == user
+    assert asyncio.run(eager_authenticate(authenticator, None, data)) == user
+
+    def authenticate(authenticator, handler, data):
+        return authenticator.authenticate(handler, data)
+
+    results = {}
+    results["eager"] = timed(eager_authenticate, authenticator, data, number)
+    results["lazy"] = timed(authenticate, authenticator, data, number)
+    authenticator.quiet_login_log = True
+    results["lazy+quiet"] = timed(authenticate, authenticator, data, number)
+    print("logins: {}, DEBUG disabled, INFO enabled".format(number))
+    for name, elapsed in results.items():
+        saved = (results["eager"] - elapsed) / number * 1e6
+        print(
+            "{:<12} {:.3f}s ({:.2f}us/login, saves {:.2f}us/login)".format(
+                name, elapsed, elapsed / number * 1e6, saved
+            )
+        )
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        main(int(sys.argv[1]))
+    else:
+        main()
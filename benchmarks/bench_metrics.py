@@ -0,0 +1,77 @@
+"""Micro-benchmark of the prometheus instrumentation cost in HeaderAuthenticator.
+
+Compares authenticate, with its latency histogram and the per allowed_headers
+key parse histograms, against the uninstrumented login path where the parse
+observers are replaced by a no-op.
+
+Usage: python benchmarks/bench_metrics.py [number]
+"""
+
+import asyncio
+import logging
+import os
+import sys
+import time
+from jhubauthenticators import Parser, JSONParser
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tests")
+)
+from mock_hub import new_authenticator  # noqa: E402
+
+NUM_HEADERS = 10
+
+
+def new_metrics_authenticator():
+    allowed_headers = {"auth": "Remote-User", "jsondata": "JsonData"}
+    parser_classes = {"auth": Parser, "jsondata": JSONParser}
+    for index in range(NUM_HEADERS):
+        allowed_headers["data{}".format(index)] = "Data-{}".format(index)
+        parser_classes["data{}".format(index)] = Parser
+    authenticator = new_authenticator(
+        allowed_headers=allowed_headers, header_parser_classes=parser_classes
+    )
+    authenticator.log.setLevel(logging.WARNING)
+    return authenticator
+
+
+async def run(authenticate, data, number):
+    start = time.perf_counter()
+    for _ in range(number):
+        await authenticate(None, data)
+    return time.perf_counter() - start
+
+
+def main(number=20000):
+    data = {"Remote-User": "my-username", "JsonData": '{"groups": ["a", "b"]}'}
+    for index in range(NUM_HEADERS):
+        data["Data-{}".format(index)] = "value-{}".format(index)
+
+    instrumented = new_metrics_authenticator()
+    uninstrumented = new_metrics_authenticator()
+    uninstrumented._parse_observers = {
+        header: lambda duration: None for header in uninstrumented._parse_observers
+    }
+
+    results = {}
+    results["uninstrumented"] = min(
+        asyncio.run(run(uninstrumented._authenticate, data, number)) for _ in range(5)
+    )
+    results["instrumented"] = min(
+        asyncio.run(run(instrumented.authenticate, data, number)) for _ in range(5)
+    )
+    print("logins: {}, headers: {}".format(number, len(data)))
+    for name, elapsed in results.items():
+        overhead = (elapsed - results["uninstrumented"]) / number * 1e6
+        print(
+            "{:<16} {:.3f}s ({:.2f}us/login, overhead {:.2f}us/login)".format(
+                name, elapsed, elapsed / number * 1e6, overhead
+            )
+        )
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        main(int(sys.argv[1]))
+    else:
+        main()
@@ -0,0 +1,61 @@
+"""Micro-benchmark of the login rate limiting cost in HeaderAuthenticator.
+
+Measures the per-login cost of login_retry_after with the per 'auth' header
+value and global token buckets enabled, for a single hot identity and for a
+large set of identities that cycles through the bucket store.
+
+Usage: python benchmarks/bench_rate_limit.py [number]
+"""
+
+import os
+import sys
+import timeit
+from itertools import cycle
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tests")
+)
+from mock_hub import new_authenticator  # noqa: E402
+
+
+def main(number=100000):
+    disabled = new_authenticator()
+    enabled = new_authenticator(
+        login_rate_limit=1e9,
+        login_rate_burst=10,
+        global_login_rate_limit=1e9,
+        global_login_rate_burst=100,
+    )
+    hot = {"Remote-User": "my-username"}
+    identities = cycle(
+        [{"Remote-User": "user-{}".format(i)} for i in range(number // 2)]
+    )
+
+    results = {}
+    results["disabled"] = min(
+        timeit.repeat(lambda: disabled.login_retry_after(hot), number=number, repeat=5)
+    )
+    results["hot identity"] = min(
+        timeit.repeat(lambda: enabled.login_retry_after(hot), number=number, repeat=5)
+    )
+    results["many identities"] = min(
+        timeit.repeat(
+            lambda: enabled.login_retry_after(next(identities)),
+            number=number,
+            repeat=5,
+        )
+    )
+    print("logins: {}".format(number))
+    for name, elapsed in results.items():
+        print(
+            "{:<16} {:.3f}s ({:.2f}us/login)".format(
+                name, elapsed, elapsed / number * 1e6
+            )
+        )
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        main(int(sys.argv[1]))
+    else:
+        main()
@@ -0,0 +1,309 @@
+"""In-process benchmark suite of the authenticators, parsers and handlers.
+
+Runs every benchmark without Docker, where the handlers are served by tornado
+with the JupyterHub application and ORM replaced by tests/mock_hub.py.
+Each benchmark reports the best time per operation of a number of repeats.
+
+The results can be saved as a baseline, and compared with a previously saved
+baseline, in which case the suite exits with 1 if any benchmark is slower
+than the baseline by more than the threshold. Since the numbers depend on
+the machine, the baseline should be recorded on the machine that compares.
+
+Usage:
+    python benchmarks/suite.py --save-baseline benchmarks/baseline.json
+    python benchmarks/suite.py --baseline benchmarks/baseline.json --threshold 0.5
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+from pytest import MonkeyPatch
+from tornado.httpclient import AsyncHTTPClient
+from traitlets.config import Config
+from jhubauthenticators import (
+    DummyAuthenticator,
+    JSONParser,
+    Parser,
+    RegexUsernameParser,
+)
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tests")
+)
+from mock_hub import (  # noqa: E402
+    MOCK_COOKIE_NAME,
+    MockHub,
+    MockHubServer,
+    MockUser,
+    new_authenticator,
+)
+
+NUM_HEADERS = [1, 5, 10, 25, 50]
+JSON_PAYLOAD_SIZES = [100, 1024, 8 * 1024, 64 * 1024]
+
+
+def new_header_authenticator(**traits):
+    authenticator = new_authenticator(**traits)
+    authenticator.log.setLevel(logging.WARNING)
+    return authenticator
+
+
+def json_payload(size):
+    """A JSON object of about size bytes"""
+    payload = {"sub": "my-username", "groups": []}
+    while len(json.dumps(payload)) < size:
+        payload["groups"].append("group-{}".format(len(payload["groups"])))
+    return json.dumps(payload)
+
+
+class Benchmark:
+    """
+    A named operation that is timed over number iterations, setup prepares
+    the operation and returns it, either as a callable or a coroutine function
+    """
+
+    def __init__(self, name, setup, number):
+        self.name = name
+        self.setup = setup
+        self.number = number
+
+    async def run(self, repeat):
+        operation = await self.setup()
+        try:
+            results = []
+            for _ in range(repeat):
+                if asyncio.iscoroutinefunction(operation):
+                    start = time.perf_counter()
+                    for _ in range(self.number):
+                        await operation()
+                else:
+                    start = time.perf_counter()
+                    for _ in range(self.number):
+                        operation()
+                results.append((time.perf_counter() - start) / self.number)
+            return min(results)
+        finally:
+            cleanup = getattr(operation, "cleanup", None)
+            if cleanup is not None:
+                await cleanup()
+
+
+def authenticate_benchmark(num_headers):
+    async def setup():
+        allowed_headers = {"auth": "Remote-User"}
+        parser_classes = {"auth": Parser}
+        data = {"Remote-User": "my-username"}
+        for index in range(num_headers - 1):
+            allowed_headers["data{}".format(index)] = "Data-{}".format(index)
+            parser_classes["data{}".format(index)] = JSONParser
+            data["Data-{}".format(index)] = json_payload(100)
+        authenticator = new_header_authenticator(
+            allowed_headers=allowed_headers, header_parser_classes=parser_classes
+        )
+
+        async def operation():
+            await authenticator.authenticate(None, data)
+
+        return operation
+
+    return Benchmark("authenticate-{}-headers".format(num_headers), setup, 2000)
+
+
+def regex_parser_benchmark():
+    async def setup():
+        config = Config()
+        config.RegexUsernameParser.username_extract_regex = r"user=([^;]+)"
+        parser = RegexUsernameParser(config=config)
+        value = "/C=DK/O=Example/user=my-username;email=user@example.org"
+        assert parser.parse(value) == "my-username"
+        return lambda: parser.parse(value)
+
+    return Benchmark("regex-username-parser", setup, 20000)
+
+
+def json_parser_benchmark(size):
+    async def setup():
+        parser = JSONParser()
+        value = json_payload(size)
+        return lambda: parser.parse(value)
+
+    return Benchmark("json-parser-{}b".format(size), setup, max(50, 200000 // size))
+
+
+def user_data_benchmark():
+    async def setup():
+        monkeypatch = MonkeyPatch()
+        mock_hub = MockHub(
+            new_header_authenticator(user_external_allow_attributes=["data"])
+        )
+        mock_hub.patch(monkeypatch)
+        mock_hub.users["my-username"] = MockUser("my-username", mock_hub.db)
+        server = MockHubServer(mock_hub)
+        await server.__aenter__()
+        client = AsyncHTTPClient(force_instance=True)
+        body = json.dumps({"data": {"key": "value"}})
+        headers = {"Cookie": "{}=my-username".format(MOCK_COOKIE_NAME)}
+
+        async def operation():
+            response = await server.fetch(
+                "/set-user-data",
+                client=client,
+                method="POST",
+                body=body,
+                headers=headers,
+            )
+            assert response.code == 200, response.code
+
+        async def cleanup():
+            client.close()
+            await server.__aexit__()
+            monkeypatch.undo()
+
+        operation.cleanup = cleanup
+        return operation
+
+    return Benchmark("user-data-post", setup, 500)
+
+
+class BenchSpawner:
+    def __init__(self):
+        self.environment = {}
+
+
+class BenchAuthStateUser:
+    def __init__(self, name, auth_state):
+        self.name = name
+        self.auth_state = auth_state
+
+    async def get_auth_state(self):
+        return dict(self.auth_state)
+
+
+def pre_spawn_start_benchmark():
+    async def setup():
+        authenticator = new_header_authenticator(
+            spawner_shared_headers=["Mail"],
+            spawner_env_projection={
+                "JsonData/sub": "USER_SUB",
+                "JsonData/groups": "USER_GROUPS",
+            },
+        )
+        user = BenchAuthStateUser(
+            "my-username",
+            {"Mail": "user@example.org", "JsonData": json.loads(json_payload(1024))},
+        )
+
+        async def operation():
+            await authenticator.pre_spawn_start(user, BenchSpawner())
+
+        return operation
+
+    return Benchmark("pre-spawn-start", setup, 5000)
+
+
+def dummy_authenticate_benchmark():
+    async def setup():
+        authenticator = DummyAuthenticator(password="password")
+        data = {"username": "my-username", "password": "password"}
+
+        async def operation():
+            await authenticator.authenticate(None, data)
+
+        return operation
+
+    return Benchmark("dummy-authenticate", setup, 20000)
+
+
+def benchmarks():
+    return (
+        [authenticate_benchmark(num_headers) for num_headers in NUM_HEADERS]
+        + [regex_parser_benchmark()]
+        + [json_parser_benchmark(size) for size in JSON_PAYLOAD_SIZES]
+        + [
+            user_data_benchmark(),
+            pre_spawn_start_benchmark(),
+            dummy_authenticate_benchmark(),
+        ]
+    )
+
+
+def compare(results, baseline, threshold):
+    """Returns the names of the benchmarks that are slower
+    than the baseline by more than the threshold"""
+    return [
+        name
+        for name, elapsed in results.items()
+        if name in baseline and elapsed > baseline[name] * (1 + threshold)
+    ]
+
+
+async def run(selected, repeat):
+    results = {}
+    for benchmark in selected:
+        results[benchmark.name] = await benchmark.run(repeat)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--baseline", help="Compare the results with this baseline JSON file"
+    )
+    parser.add_argument(
+        "--save-baseline", help="Save the results as a baseline JSON file"
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.5,
+        help="The allowed slowdown compared to the baseline, default 0.5",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=5, help="The number of repeats, default 5"
+    )
+    parser.add_argument(
+        "--filter", default="", help="Only run the benchmarks that contain this"
+    )
+    args = parser.parse_args(argv)
+
+    selected = [
+        benchmark for benchmark in benchmarks() if args.filter in benchmark.name
+    ]
+    results = asyncio.run(run(selected, args.repeat))
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline, "r") as _file:
+            baseline = json.load(_file)
+
+    for name, elapsed in results.items():
+        line = "{:<28} {:>12.2f}us/op".format(name, elapsed * 1e6)
+        if name in baseline:
+            change = (elapsed - baseline[name]) / baseline[name]
+            line += " ({:+.1%} of baseline {:.2f}us/op)".format(
+                change, baseline[name] * 1e6
+            )
+        print(line)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as _file:
+            json.dump(results, _file, indent=4, sort_keys=True)
+            _file.write("\n")
+
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print(
+            "Regressed by more than {:.0%}: {}".format(
+                args.threshold, ", ".join(regressions)
+            )
+        )
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
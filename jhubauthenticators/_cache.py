@@ -0,0 +1,99 @@
+import threading
+import time
+from collections import OrderedDict
+
+_missing = object()
+
+
+class LRUCache:
+    """
+    A bounded least recently used cache, where every entry expires
+    after ttl seconds. A ttl of 0 disables the expiry.
+    Optionally every entry can be given a weight, e.g. its approximate size
+    in bytes, where the total weight of the cache is capped by max_weight.
+    The cache can be shared with the parser executor threads.
+    """
+
+    def __init__(self, max_size=1024, ttl=0, max_weight=0, timer=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.max_weight = max_weight
+        self.weight = 0
+        self.hits = 0
+        self.misses = 0
+        self._timer = timer
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return self.get(key, _missing, count=False) is not _missing
+
+    def get(self, key, default=None, count=True):
+        with self._lock:
+            return self._get(key, default, count)
+
+    def _get(self, key, default, count):
+        entry = self._entries.get(key, None)
+        if entry is None:
+            if count:
+                self.misses += 1
+            return default
+        value, expires, weight = entry
+        if expires and expires <= self._timer():
+            del self._entries[key]
+            self.weight -= weight
+            if count:
+                self.misses += 1
+            return default
+        self._entries.move_to_end(key)
+        if count:
+            self.hits += 1
+        return value
+
+    def set(self, key, value, weight=0):
+        with self._lock:
+            self._set(key, value, weight)
+
+    def _set(self, key, value, weight):
+        if self.max_weight and weight > self.max_weight:
+            # Would evict everything else and still not fit
+            self.pop(key)
+            return
+        expires = self._timer() + self.ttl if self.ttl else 0
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self.weight -= previous[2]
+        self._entries[key] = (value, expires, weight)
+        self.weight += weight
+        while len(self._entries) > self.max_size or (
+            self.max_weight and self.weight > self.max_weight
+        ):
+            _, (_, _, evicted_weight) = self._entries.popitem(last=False)
+            self.weight -= evicted_weight
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return default
+            self.weight -= entry[2]
+            return entry[0]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.weight = 0
+
+    def info(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "weight": self.weight,
+            "max_weight": self.max_weight,
+            "ttl": self.ttl,
+        }
@@ -0,0 +1,192 @@
+"""
+Replays a corpus of captured header sets through the HeaderAuthenticator of a
+jupyterhub_config.py file without a hub, to validate the configured parsers.
+
+The corpus is a JSON lines file in the same format as the load generator's,
+which is streamed in batches through authenticate_many, such that large
+captures are checked in constant memory. A JSON result is written for every
+record, and a summary with the failure reasons and the throughput is written
+at the end.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+from collections import deque
+from traitlets.config.loader import PyFileConfigLoader
+from tornado import web
+from tornado.httputil import HTTPHeaders
+from jupyterhub.utils import maybe_future
+from ._corpus import iter_lines, parse_record
+from ._jhub_header_auth import HeaderAuthenticator
+
+
+def load_authenticator(config_file, log_level=logging.CRITICAL):
+    """Instantiate the HeaderAuthenticator with the config file"""
+    loader = PyFileConfigLoader(
+        os.path.basename(config_file), path=os.path.dirname(config_file) or "."
+    )
+    authenticator = HeaderAuthenticator(config=loader.load_config())
+    authenticator.log.setLevel(log_level)
+    return authenticator
+
+
+def failure_reason(err):
+    if isinstance(err, web.HTTPError):
+        return "HTTP {}: {}".format(err.status_code, err.log_message)
+    return "{}: {}".format(type(err).__name__, err)
+
+
+async def check_user(authenticator, user, check_allowed=False):
+    """Check the authenticated user model, returns a tuple of the username
+    and auth_state, or raises the reason why it failed"""
+    if not user:
+        raise ValueError("no user was returned")
+    name = authenticator.normalize_username(user["name"])
+    if not authenticator.validate_username(name):
+        raise ValueError("invalid username: {}".format(name))
+    if check_allowed:
+        allowed = await maybe_future(authenticator.check_allowed(name, user))
+        if not allowed:
+            raise ValueError("user: {} is not allowed".format(name))
+    return name, user.get("auth_state", None)
+
+
+def failed(line_number, err):
+    return {"line": line_number, "ok": False, "reason": failure_reason(err)}
+
+
+async def check_corpus(authenticator, corpus, check_allowed=False, batch_size=256):
+    """Yields the result of every record in the corpus, where the records are
+    authenticated in batches by authenticate_many"""
+    # The line numbers of the records that have been read, in order, with the
+    # error of the records that couldn't be read
+    lines = deque()
+
+    def header_maps():
+        for line_number, line in iter_lines(corpus):
+            try:
+                headers, _ = parse_record(line)
+                headers = HTTPHeaders(headers)
+            except Exception as err:
+                lines.append((line_number, err))
+                continue
+            lines.append((line_number, None))
+            yield headers
+
+    async for user in authenticator.authenticate_many(
+        header_maps(), batch_size=batch_size
+    ):
+        line_number, err = lines.popleft()
+        while err is not None:
+            yield failed(line_number, err)
+            line_number, err = lines.popleft()
+        try:
+            if isinstance(user, Exception):
+                raise user
+            name, auth_state = await check_user(
+                authenticator, user, check_allowed=check_allowed
+            )
+        except Exception as err:
+            yield failed(line_number, err)
+        else:
+            yield {
+                "line": line_number,
+                "ok": True,
+                "name": name,
+                "auth_state_keys": sorted(auth_state) if auth_state else [],
+            }
+    # The unreadable records after the last authenticated record
+    for line_number, err in lines:
+        yield failed(line_number, err)
+
+
+class Summary:
+    """Counts the results and the failure reasons"""
+
+    def __init__(self):
+        self.records = 0
+        self.failures = 0
+        self.reasons = {}
+        self.start = time.perf_counter()
+
+    def add(self, result):
+        self.records += 1
+        if not result["ok"]:
+            self.failures += 1
+            self.reasons[result["reason"]] = self.reasons.get(result["reason"], 0) + 1
+
+    def report(self):
+        elapsed = time.perf_counter() - self.start
+        return {
+            "records": self.records,
+            "succeeded": self.records - self.failures,
+            "failed": self.failures,
+            "failure_reasons": dict(
+                sorted(self.reasons.items(), key=lambda item: -item[1])
+            ),
+            "elapsed_seconds": elapsed,
+            "records_per_second": self.records / elapsed if elapsed else 0,
+        }
+
+
+async def run(args, output):
+    authenticator = load_authenticator(
+        args.config, log_level=getattr(logging, args.log_level)
+    )
+    summary = Summary()
+    async for result in check_corpus(
+        authenticator,
+        args.corpus,
+        check_allowed=args.check_allowed,
+        batch_size=args.batch_size,
+    ):
+        summary.add(result)
+        if args.failures_only and result["ok"]:
+            continue
+        if not args.quiet:
+            output.write(json.dumps(result) + "\n")
+    return summary.report()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Replay a corpus of header sets through the HeaderAuthenticator "
+        "of a jupyterhub_config.py file without a hub"
+    )
+    parser.add_argument("config", help="The jupyterhub_config.py file")
+    parser.add_argument("corpus", help="The JSON lines file of header sets")
+    parser.add_argument(
+        "--check-allowed",
+        action="store_true",
+        help="Also check that the users are allowed by the configuration",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=256,
+        help="The number of records that are authenticated at once, default 256",
+    )
+    parser.add_argument(
+        "--failures-only", action="store_true", help="Only output the failed records"
+    )
+    parser.add_argument("--quiet", action="store_true", help="Only output the summary")
+    parser.add_argument(
+        "--log-level",
+        default="CRITICAL",
+        choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"],
+        help="The log level of the authenticator, default CRITICAL",
+    )
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(run(args, sys.stdout))
+    sys.stderr.write(json.dumps(report, indent=4) + "\n")
+    return 1 if report["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,103 @@
+import base64
+import json
+import zlib
+
+# The zlib window bits of each supported compression format
+COMPRESSION_WBITS = {"zlib": zlib.MAX_WBITS, "deflate": -zlib.MAX_WBITS, "gzip": 31}
+
+
+class DecompressionError(ValueError):
+    pass
+
+
+def _b64_chunks(chunks):
+    """Yields the base64url decoded bytes of a sequence of base64url chunks,
+    where a chunk's trailing characters that don't make up a full 4 character
+    quantum are carried over to the next chunk, such that the chunks can be
+    split anywhere. The padding may be left out"""
+    carry = b""
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode("ascii")
+        chunk = chunk.strip()
+        if carry:
+            chunk = carry + chunk
+        usable = len(chunk) - len(chunk) % 4
+        carry = chunk[usable:]
+        if usable:
+            yield base64.urlsafe_b64decode(chunk[:usable])
+    if carry:
+        yield base64.urlsafe_b64decode(carry + b"=" * (-len(carry) % 4))
+
+
+def decompress_chunks(chunks, compression="zlib", max_size=1024 * 1024):
+    """Decode and decompress a base64url encoded payload that is split
+    across a sequence of chunks, in a single pass over the chunks.
+    Raises a DecompressionError if the payload is invalid, truncated,
+    or decompresses to more than max_size bytes"""
+    decompressor = zlib.decompressobj(COMPRESSION_WBITS[compression])
+    output = []
+    size = 0
+    try:
+        for data in _b64_chunks(chunks):
+            if decompressor.eof:
+                raise DecompressionError("trailing data after the compressed payload")
+            # Allow one byte more than the remaining size to detect the overflow,
+            # the rest of the input is left in unconsumed_tail
+            piece = decompressor.decompress(data, max_size - size + 1)
+            size += len(piece)
+            if size > max_size:
+                raise DecompressionError(
+                    "the payload decompresses to more than: {} bytes".format(max_size)
+                )
+            output.append(piece)
+    except (ValueError, zlib.error) as err:
+        if isinstance(err, DecompressionError):
+            raise
+        raise DecompressionError(str(err)) from err
+    if not decompressor.eof:
+        raise DecompressionError("the compressed payload is truncated")
+    return b"".join(output)
+
+
+def compress(data, compression="zlib", level=6):
+    """Compress and base64url encode the data without padding,
+    the inverse of decompress_chunks for a single chunk"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, COMPRESSION_WBITS[compression])
+    payload = compressor.compress(data) + compressor.flush()
+    return base64.urlsafe_b64encode(payload).rstrip(b"=").decode("ascii")
+
+
+# The prefix of the auth_state values that are stored compressed
+COMPRESSED_VALUE_PREFIX = "zlib+json:"
+# The hard limit of a decompressed auth_state value
+MAX_DECOMPRESSED_VALUE_SIZE = 64 * 1024 * 1024
+
+
+def compress_value(value, threshold):
+    """Returns the value as a prefixed string of its compressed compact JSON
+    encoding if the encoding is at least threshold bytes, otherwise the value.
+    Strings that already start with the prefix are always compressed,
+    so that decompress_value only decodes values that were compressed"""
+    if isinstance(value, str) and value.startswith(COMPRESSED_VALUE_PREFIX):
+        threshold = 0
+    elif isinstance(value, str) and len(value) * 6 + 2 < threshold:
+        # Skip the encoding of strings that can't reach the threshold,
+        # even if every character is escaped
+        return value
+    encoded = json.dumps(value, separators=(",", ":")).encode("utf-8")
+    if len(encoded) < threshold:
+        return value
+    return COMPRESSED_VALUE_PREFIX + compress(encoded)
+
+
+def decompress_value(value):
+    """The inverse of compress_value, other values are returned as is"""
+    if isinstance(value, str) and value.startswith(COMPRESSED_VALUE_PREFIX):
+        return json.loads(
+            decompress_chunks(
+                (value.partition(COMPRESSED_VALUE_PREFIX)[2],),
+                max_size=MAX_DECOMPRESSED_VALUE_SIZE,
+            )
+        )
+    return value
@@ -0,0 +1,31 @@
+import json
+
+
+def iter_lines(path):
+    """Yields the (line number, line) of the non-blank lines in the file,
+    one at a time such that large files are read in constant memory"""
+    with open(path, "r") as _file:
+        for line_number, line in enumerate(_file, start=1):
+            line = line.strip()
+            if line:
+                yield line_number, line
+
+
+def parse_record(line):
+    """Parse a corpus line, which is either a JSON object of headers, or an
+    object with a 'headers' object and an optional 'user_data' object.
+    Returns a tuple of the headers and user_data"""
+    record = json.loads(line)
+    if not isinstance(record, dict):
+        raise ValueError(
+            "expected a JSON object, got: {}".format(type(record).__name__)
+        )
+    if "headers" in record:
+        headers, user_data = record["headers"], record.get("user_data", None)
+    else:
+        headers, user_data = record, None
+    if not isinstance(headers, dict):
+        raise ValueError(
+            "expected a headers object, got: {}".format(type(headers).__name__)
+        )
+    return headers, user_data
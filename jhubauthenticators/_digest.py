@@ -0,0 +1,21 @@
+import json
+import hashlib
+
+
+def values_digest(values):
+    """Returns a compact digest of a sequence of header values,
+    missing values are expected to be passed as None"""
+    return hashlib.blake2b(
+        repr(tuple(values)).encode("utf-8", "surrogatepass"), digest_size=16
+    ).digest()
+
+
+def content_digest(obj):
+    """Returns a compact digest of a JSON serializable object,
+    that is independent of the dictionary key order"""
+    return hashlib.blake2b(
+        json.dumps(obj, sort_keys=True, separators=(",", ":"), default=str).encode(
+            "utf-8", "surrogatepass"
+        ),
+        digest_size=16,
+    ).digest()
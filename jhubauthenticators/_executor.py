@@ -0,0 +1,71 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ParserExecutor:
+    """
+    Runs header parse calls in a bounded thread pool, so that large
+    payloads don't stall the event loop, and records the queue depth and
+    parse time of the offloaded calls
+    """
+
+    def __init__(self, max_workers=4):
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="jhubauthenticators-parser"
+        )
+        self._lock = threading.Lock()
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.inline = 0
+        self.offloaded = 0
+        self.parse_time = 0.0
+        self.max_parse_time = 0.0
+        self.wait_time = 0.0
+
+    def run_inline(self, parse, data):
+        self.inline += 1
+        return parse(data)
+
+    async def run(self, parse, data):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            self.offloaded += 1
+            self.queue_depth += 1
+            if self.queue_depth > self.max_queue_depth:
+                self.max_queue_depth = self.queue_depth
+        return await loop.run_in_executor(
+            self._executor, self._timed_parse, parse, data, time.perf_counter()
+        )
+
+    def _timed_parse(self, parse, data, submitted):
+        start = time.perf_counter()
+        with self._lock:
+            self.queue_depth -= 1
+            self.wait_time += start - submitted
+        try:
+            return parse(data)
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.parse_time += elapsed
+                if elapsed > self.max_parse_time:
+                    self.max_parse_time = elapsed
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+    def info(self):
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "queue_depth": self.queue_depth,
+                "max_queue_depth": self.max_queue_depth,
+                "inline": self.inline,
+                "offloaded": self.offloaded,
+                "parse_time": self.parse_time,
+                "max_parse_time": self.max_parse_time,
+                "wait_time": self.wait_time,
+            }
@@ -1,8 +1,62 @@
+import asyncio
+import functools
+import inspect
+import json
+import logging
+import os
+import time
+from collections import Counter
+from copy import deepcopy
 from tornado import web
 from jupyterhub.auth import Authenticator
 from jupyterhub.handlers.login import LogoutHandler
-from traitlets import Dict, List, Type, Instance, Unicode, default
-from ._jhub_shared import HeaderLoginHandler, UserDataHandler, Parser
+from jupyterhub.utils import utcnow
+from traitlets import (
+    Bool,
+    Dict,
+    Float,
+    List,
+    Type,
+    Instance,
+    Integer,
+    Unicode,
+    default,
+    observe,
+)
+from traitlets.config.loader import Config, PyFileConfigLoader
+from traitlets.utils.importstring import import_item
+from ._cache import LRUCache
+from ._compression import COMPRESSED_VALUE_PREFIX, compress_value, decompress_value
+from ._digest import content_digest, values_digest
+from ._executor import ParserExecutor
+from ._jhub_shared import (
+    HeaderConfigReloadHandler,
+    HeaderLoginHandler,
+    UserDataHandler,
+    Parser,
+    AsyncParser,
+    install_header_bound_sessions,
+)
+from ._jsonpointer import parse_pointer, resolve_pointer
+from ._metrics import (
+    AUTHENTICATE_FAILURE_DURATION_SECONDS,
+    AUTHENTICATE_SUCCESS_DURATION_SECONDS,
+    HEADER_PARSE_DURATION_SECONDS,
+    LOGIN_FAILURES,
+    PRE_SPAWN_START_DURATION_SECONDS,
+    LoginFailureReason,
+)
+from ._ratelimit import TokenBucketLimiter
+from ._singleflight import SingleFlight
+from ._logging import LogRateLimiter, LogSampler
+
+# The HeaderAuthenticator traits that reload_header_config applies
+RELOADABLE_TRAITS = (
+    "allowed_headers",
+    "header_parser_classes",
+    "spawner_shared_headers",
+    "spawner_env_projection",
+)
 
 
 class HeaderAuthenticator(Authenticator):
@@ -32,11 +86,32 @@ class HeaderAuthenticator(Authenticator):
 
     @default("header_parsers")
     def _header_parsers_default(self):
+        return self._new_header_parsers(self.header_parser_classes)
+
+    def _new_header_parsers(self, header_parser_classes, config=None):
         return {
-            parser_key: parser_val(parent=self)
-            for parser_key, parser_val in self.header_parser_classes.items()
+            parser_key: parser_val(parent=self, config=config)
+            for parser_key, parser_val in header_parser_classes.items()
         }
 
+    @observe("header_parser_classes")
+    def _header_parser_classes_changed(self, change):
+        # reload_header_config swaps in the parsers before the config
+        if {
+            parser_key: type(parser)
+            for parser_key, parser in self.header_parsers.items()
+        } == change.new:
+            return
+        self.header_parsers = self._header_parsers_default()
+
+    @observe("allowed_headers", "header_parsers")
+    def _extraction_plan_changed(self, change):
+        self._extraction_plan = self._build_extraction_plan()
+        self._parse_observers = self._build_parse_observers()
+        # Cached results were produced by the previous plan
+        if getattr(self, "_auth_result_cache", None) is not None:
+            self._auth_result_cache.clear()
+
     spawner_shared_headers = List(
         default_value=[],
         allow_none=False,
@@ -45,6 +120,52 @@ class HeaderAuthenticator(Authenticator):
         """,
     ).tag(config=True)
 
+    spawner_env_projection = Dict(
+        default_value={},
+        key_trait=Unicode(),
+        value_trait=Unicode(),
+        help="""Dict that projects auth_state values into spawner environment
+         variables via the pre_spawn_start hook. Each key is either an auth_state
+         key or an auth_state key followed by a JSON pointer into its parsed
+         value, and each value is the name of the environment variable. Values
+         that are not strings are JSON encoded.
+
+         E.g: {'JsonData/claims/email': 'USER_EMAIL', 'StringData': 'STRING_DATA'}
+        """,
+    ).tag(config=True)
+
+    spawner_env_max_value_size = Integer(
+        default_value=0,
+        help="""The maximum size of a projected spawner environment value,
+         larger values are skipped. 0 disables the limit.
+        """,
+    ).tag(config=True)
+
+    @observe("spawner_shared_headers", "spawner_env_projection")
+    def _env_projection_changed(self, change):
+        self._env_projection = self._build_env_projection()
+
+    def _build_env_projection(
+        self, spawner_shared_headers=None, spawner_env_projection=None
+    ):
+        """Compile the spawner_shared_headers and spawner_env_projection into an
+        ordered tuple of (auth_state key, JSON pointer tokens, environment name,
+        encode) entries, where encode defines whether the value is JSON encoded
+        if it isn't a string"""
+        if spawner_shared_headers is None:
+            spawner_shared_headers = self.spawner_shared_headers
+        if spawner_env_projection is None:
+            spawner_env_projection = self.spawner_env_projection
+        projection = [
+            (shared_header, (), shared_header, False)
+            for shared_header in spawner_shared_headers
+        ]
+        for source, env_name in spawner_env_projection.items():
+            auth_key, _, pointer = source.partition("/")
+            tokens = parse_pointer("/" + pointer) if pointer else ()
+            projection.append((auth_key, tokens, env_name, True))
+        return tuple(projection)
+
     user_external_allow_attributes = List(
         default_value=[],
         traits=[Unicode()],
@@ -54,6 +175,353 @@ class HeaderAuthenticator(Authenticator):
         """,
     ).tag(config=True)
 
+    quiet_login_log = Bool(
+        default_value=False,
+        help="""Quiet production mode, where the per-login
+         'Authenticated: <user> - Login' INFO line is only logged for every
+         quiet_login_log_interval successful login.
+        """,
+    ).tag(config=True)
+
+    quiet_login_log_interval = Integer(
+        default_value=100,
+        help="""The sample interval of the login INFO line
+         when quiet_login_log is enabled.
+        """,
+    ).tag(config=True)
+
+    login_log_sampler = Instance(LogSampler)
+
+    @default("login_log_sampler")
+    def _login_log_sampler_default(self):
+        return LogSampler(self.quiet_login_log_interval)
+
+    @observe("quiet_login_log_interval")
+    def _quiet_login_log_interval_changed(self, change):
+        self.login_log_sampler = LogSampler(change["new"])
+
+    reject_missing_auth_header = Bool(
+        default_value=False,
+        help="""Reject requests to /login that don't have the 'auth' header, e.g.
+         load balancer health checks, with a small pre-rendered 401 response
+         before the user is authenticated, instead of rendering the error page.
+        """,
+    ).tag(config=True)
+
+    missing_header_log_interval = Float(
+        default_value=60.0,
+        help="""The minimum number of seconds between the error logs of
+         rejected requests without the 'auth' header, the number of
+         rejections that weren't logged in between is included in the log.
+        """,
+    ).tag(config=True)
+
+    missing_header_log_limiter = Instance(LogRateLimiter)
+
+    @default("missing_header_log_limiter")
+    def _missing_header_log_limiter_default(self):
+        return LogRateLimiter(self.missing_header_log_interval)
+
+    @observe("missing_header_log_interval")
+    def _missing_header_log_interval_changed(self, change):
+        self.missing_header_log_limiter = LogRateLimiter(change["new"])
+
+    login_rate_limit = Float(
+        default_value=0.0,
+        help="""The number of logins per second that are allowed for each 'auth'
+         header value, after the login_rate_burst has been used. Logins above the
+         limit are answered with 429 and a Retry-After header. 0 disables the limit.
+        """,
+    ).tag(config=True)
+
+    login_rate_burst = Integer(
+        default_value=10,
+        help="""The number of logins that each 'auth' header value
+         can make at once before login_rate_limit applies.
+        """,
+    ).tag(config=True)
+
+    login_rate_limit_max_keys = Integer(
+        default_value=100000,
+        help="""The maximum number of 'auth' header values that are rate
+         limited at once, the least recently seen values are evicted first.
+        """,
+    ).tag(config=True)
+
+    global_login_rate_limit = Float(
+        default_value=0.0,
+        help="""The number of logins per second that are allowed across all
+         users, after the global_login_rate_burst has been used. 0 disables the limit.
+        """,
+    ).tag(config=True)
+
+    global_login_rate_burst = Integer(
+        default_value=100,
+        help="""The number of logins that can be made at once
+         before global_login_rate_limit applies.
+        """,
+    ).tag(config=True)
+
+    @observe(
+        "login_rate_limit",
+        "login_rate_burst",
+        "login_rate_limit_max_keys",
+        "global_login_rate_limit",
+        "global_login_rate_burst",
+    )
+    def _login_rate_limit_config_changed(self, change):
+        self._login_limiter, self._global_login_limiter = self._new_login_limiters()
+
+    def _new_login_limiters(self):
+        login_limiter, global_login_limiter = None, None
+        if self.login_rate_limit > 0:
+            login_limiter = TokenBucketLimiter(
+                self.login_rate_limit,
+                self.login_rate_burst,
+                max_keys=self.login_rate_limit_max_keys,
+            )
+        if self.global_login_rate_limit > 0:
+            global_login_limiter = TokenBucketLimiter(
+                self.global_login_rate_limit, self.global_login_rate_burst, max_keys=1
+            )
+        return login_limiter, global_login_limiter
+
+    auth_result_cache_size = Integer(
+        default_value=0,
+        help="""The maximum number of authentication results that are cached by the
+         allowed_headers values, such that repeated logins with the exact same
+         headers are not parsed again. 0 disables the cache.
+         The cache is bypassed if an allowed_headers key has no header parser.
+        """,
+    ).tag(config=True)
+
+    auth_result_cache_ttl = Float(
+        default_value=60.0,
+        help="""The number of seconds a cached authentication result is valid for.
+        """,
+    ).tag(config=True)
+
+    auth_result_cache_max_bytes = Integer(
+        default_value=16 * 1024 * 1024,
+        help="""Upper limit on the approximate memory usage of the authentication
+         result cache, estimated from the size of the cached header values.
+        """,
+    ).tag(config=True)
+
+    @observe(
+        "auth_result_cache_size", "auth_result_cache_ttl", "auth_result_cache_max_bytes"
+    )
+    def _auth_result_cache_config_changed(self, change):
+        self._auth_result_cache = self._new_auth_result_cache()
+
+    def _new_auth_result_cache(self):
+        if self.auth_result_cache_size > 0:
+            return LRUCache(
+                max_size=self.auth_result_cache_size,
+                ttl=self.auth_result_cache_ttl,
+                max_weight=self.auth_result_cache_max_bytes,
+            )
+        return None
+
+    skip_unchanged_auth_state = Bool(
+        default_value=False,
+        help="""Keep a digest of each user's last stored auth_state, and skip
+         re-encrypting and storing the auth_state on login when the new
+         auth_state has the same digest.
+        """,
+    ).tag(config=True)
+
+    auth_state_digest_cache_size = Integer(
+        default_value=10000,
+        help="""The maximum number of users whose auth_state digest is kept
+         when skip_unchanged_auth_state is enabled.
+        """,
+    ).tag(config=True)
+
+    auth_state_digest_ttl = Float(
+        default_value=3600.0,
+        help="""The number of seconds an auth_state digest is trusted for,
+         after which the auth_state is stored again on the next login.
+        """,
+    ).tag(config=True)
+
+    @observe("auth_state_digest_cache_size", "auth_state_digest_ttl")
+    def _auth_state_digest_config_changed(self, change):
+        self._auth_state_digests = self._new_auth_state_digests()
+
+    def _new_auth_state_digests(self):
+        return LRUCache(
+            max_size=self.auth_state_digest_cache_size,
+            ttl=self.auth_state_digest_ttl,
+        )
+
+    refresh_digest_cache_size = Integer(
+        default_value=10000,
+        help="""The maximum number of users whose digest of the allowed_headers
+         values is kept, which refresh_user compares with the headers of the
+         current request to skip the parsing when they are unchanged.
+        """,
+    ).tag(config=True)
+
+    @observe("refresh_digest_cache_size")
+    def _refresh_digest_config_changed(self, change):
+        self._refresh_digests = self._new_refresh_digests()
+
+    def _new_refresh_digests(self):
+        return LRUCache(max_size=self.refresh_digest_cache_size)
+
+    auth_state_cache_ttl = Float(
+        default_value=0.0,
+        help="""The number of seconds a decrypted auth_state is cached for and
+         reused by pre_spawn_start, e.g. when a user spawns several named servers.
+         The cached auth_state is dropped when a new auth_state is stored
+         on login. 0 disables the cache.
+        """,
+    ).tag(config=True)
+
+    auth_state_cache_size = Integer(
+        default_value=1024,
+        help="""The maximum number of users whose decrypted auth_state is cached.
+        """,
+    ).tag(config=True)
+
+    @observe("auth_state_cache_ttl", "auth_state_cache_size")
+    def _auth_state_cache_config_changed(self, change):
+        self._auth_state_cache = self._new_auth_state_cache()
+
+    def _new_auth_state_cache(self):
+        if self.auth_state_cache_ttl > 0:
+            return LRUCache(
+                max_size=self.auth_state_cache_size, ttl=self.auth_state_cache_ttl
+            )
+        return None
+
+    auth_state_compression_threshold = Integer(
+        default_value=0,
+        help="""The auth_state values whose compact JSON encoding is at least this
+         number of bytes are stored zlib compressed, which reduces the size of
+         the auth_state that JupyterHub encrypts, stores and decrypts.
+         The values are decompressed by get_auth_state and pre_spawn_start,
+         uncompressed values are read as is. 0 disables the compression.
+        """,
+    ).tag(config=True)
+
+    parser_offload_threshold = Integer(
+        default_value=0,
+        help="""Header values longer than this number of characters are parsed
+         in a bounded thread pool instead of on the event loop, smaller values
+         are parsed inline. Since the headers are decoded as latin-1, this is
+         the size in bytes of the received header value. 0 disables the thread
+         pool.
+        """,
+    ).tag(config=True)
+
+    parser_offload_max_workers = Integer(
+        default_value=4,
+        help="""The number of threads used to parse header values that
+         are larger than the parser_offload_threshold.
+        """,
+    ).tag(config=True)
+
+    @observe("parser_offload_threshold", "parser_offload_max_workers")
+    def _parser_executor_config_changed(self, change):
+        previous = getattr(self, "_parser_executor", None)
+        self._parser_executor = self._new_parser_executor()
+        if previous is not None:
+            previous.shutdown(wait=False)
+
+    def _new_parser_executor(self):
+        if self.parser_offload_threshold > 0:
+            return ParserExecutor(max_workers=self.parser_offload_max_workers)
+        return None
+
+    @property
+    def parser_executor_metrics(self):
+        """The queue depth and parse time metrics of the parser thread pool"""
+        if self._parser_executor is None:
+            return {}
+        return self._parser_executor.info()
+
+    login_server_timing = Bool(
+        default_value=False,
+        help="""Add a Server-Timing header to the /login redirect, with the
+         durations in milliseconds of the login stages. These are the
+         authenticate call, each header parser, the login_user call that
+         includes storing the user, and the redirect.
+        """,
+    ).tag(config=True)
+
+    login_timing_log = Bool(
+        default_value=False,
+        help="""Write the login stage timings of every /login
+         request to the DEBUG log.
+        """,
+    ).tag(config=True)
+
+    coalesce_concurrent_logins = Bool(
+        default_value=False,
+        help="""Let concurrent logins with the same allowed_headers values, e.g.
+         every browser tab of a user after a proxy restart, await a single
+         login instead of each authenticating and storing the user.
+        """,
+    ).tag(config=True)
+
+    header_bound_sessions = Bool(
+        default_value=False,
+        help="""Resolve the current user from the trusted 'auth' header on every
+         hub request instead of the login cookie, which removes the /login
+         redirect and cookie round-trip for users that exist in the database.
+         Unknown users are still sent to /login, and requests without the header
+         fall back to the login cookie, as do all requests when the 'auth' header
+         parser is an AsyncParser. Only enable this when every request is
+         passed through a proxy that sets the 'auth' header.
+         This wraps the get_current_user_cookie of the JupyterHub BaseHandler,
+         which applies to the whole process, but the wrapper only acts for
+         authenticators that enable header_bound_sessions.
+        """,
+    ).tag(config=True)
+
+    header_user_cache_size = Integer(
+        default_value=10000,
+        help="""The maximum number of 'auth' header values whose resolved user
+         is cached when header_bound_sessions is enabled.
+        """,
+    ).tag(config=True)
+
+    header_user_cache_ttl = Float(
+        default_value=60.0,
+        help="""The number of seconds a user that was resolved from the
+         'auth' header is cached for.
+        """,
+    ).tag(config=True)
+
+    @observe("header_user_cache_size", "header_user_cache_ttl")
+    def _header_user_cache_config_changed(self, change):
+        self._header_user_cache = self._new_header_user_cache()
+
+    def _new_header_user_cache(self):
+        return LRUCache(
+            max_size=self.header_user_cache_size, ttl=self.header_user_cache_ttl
+        )
+
+    header_config_reload = Bool(
+        default_value=False,
+        help="""Enable the admin only POST /reload-header-config endpoint, which
+         reloads the allowed_headers, header_parser_classes, the configuration
+         of the parsers, spawner_shared_headers and spawner_env_projection from
+         the header_config_file without restarting the hub.
+        """,
+    ).tag(config=True)
+
+    header_config_file = Unicode(
+        default_value="",
+        help="""The Python config file that the header configuration is reloaded
+         from, in the same format as the jupyterhub_config.py file. Only the
+         reloadable HeaderAuthenticator traits and the sections of the parser
+         classes are applied. Defaults to the config file of the hub.
+        """,
+    ).tag(config=True)
+
     def __init__(self, **kwargs):
         if "auth" not in self.allowed_headers:
             self.log.error(
@@ -62,90 +530,713 @@ class HeaderAuthenticator(Authenticator):
             )
             raise KeyError("Missing required 'auth' key in allowed_headers")
         super().__init__(**kwargs)
+        self._extraction_plan = self._build_extraction_plan()
+        self._parse_observers = self._build_parse_observers()
+        self._env_projection = self._build_env_projection()
+        if getattr(self, "_parser_executor", None) is None:
+            self._parser_executor = self._new_parser_executor()
+        self._auth_result_cache = self._new_auth_result_cache()
+        self._auth_state_digests = self._new_auth_state_digests()
+        self._auth_state_cache = self._new_auth_state_cache()
+        self._auth_state_flight = SingleFlight()
+        self.login_flight = SingleFlight()
+        # Bumped on every invalidation, so that decryptions that were in-flight
+        # while a new auth_state was stored don't cache the previous state
+        self._auth_state_generation = 0
+        self._header_user_cache = self._new_header_user_cache()
+        self._refresh_digests = self._new_refresh_digests()
+        self.missing_header_rejections = 0
+        self._login_limiter, self._global_login_limiter = self._new_login_limiters()
 
     def get_handlers(self, app):
-        return [
+        if self.header_bound_sessions:
+            install_header_bound_sessions()
+        handlers = [
             (r"/login", HeaderLoginHandler),
             (r"/logout", LogoutHandler),
             (r"/set-user-data", UserDataHandler),
         ]
+        if self.header_config_reload:
+            handlers.append((r"/reload-header-config", HeaderConfigReloadHandler))
+        return handlers
 
-    async def authenticate(self, handler, data):
-        self.log.debug(
-            "HeaderAuthenticator - Request authentication with "
-            "handler: {}, data: {} of type: {}".format(handler, data, type(data))
+    def reload_header_config(self):
+        """Reload the header configuration from the header_config_file.
+        The new parsers and plan are built and validated before anything is
+        replaced, so a failed reload raises and keeps the previous
+        configuration. The swap itself doesn't await, and logins that are
+        in-flight keep the extraction plan that they started with"""
+        config_file = self.header_config_file or getattr(self.parent, "config_file", "")
+        if not config_file:
+            raise ValueError("There is no header_config_file to reload from")
+        loaded = PyFileConfigLoader(
+            os.path.basename(config_file), path=os.path.dirname(config_file) or "."
+        ).load_config()
+        section = loaded.get("HeaderAuthenticator", {})
+
+        values = {}
+        for name in RELOADABLE_TRAITS:
+            value = section[name] if name in section else getattr(self, name)
+            values[name] = self.traits()[name].validate(self, value)
+        if "auth" not in values["allowed_headers"]:
+            raise KeyError("Missing required 'auth' key in allowed_headers")
+        header_parser_classes = {}
+        for parser_key, parser_class in values["header_parser_classes"].items():
+            if isinstance(parser_class, str):
+                parser_class = import_item(parser_class)
+            if not (
+                isinstance(parser_class, type) and issubclass(parser_class, Parser)
+            ):
+                raise TypeError(
+                    "The header parser class of: {} is not a Parser: {}".format(
+                        parser_key, parser_class
+                    )
+                )
+            header_parser_classes[parser_key] = parser_class
+        values["header_parser_classes"] = header_parser_classes
+
+        # The current config, with the reloaded traits and parser sections.
+        # A parser section that is no longer in the file is reset
+        config = deepcopy(self.config)
+        for name, value in values.items():
+            config.HeaderAuthenticator[name] = value
+        for parser_class in header_parser_classes.values():
+            for base in parser_class.mro():
+                if issubclass(base, Parser):
+                    name = base.__name__
+                    config[name] = Config(
+                        deepcopy(loaded[name] if name in loaded else {})
+                    )
+
+        # Precompile, such that invalid parser configurations raise here
+        header_parsers = self._new_header_parsers(header_parser_classes, config=config)
+        self._build_extraction_plan(values["allowed_headers"], header_parsers)
+        self._build_env_projection(
+            values["spawner_shared_headers"], values["spawner_env_projection"]
         )
-        self.log.debug(
-            "HeaderAuthenticator allowed headers: {}".format(self.allowed_headers)
+
+        # Swap, the observers rebuild the plan from the validated traits.
+        # The parsers go first, so the config doesn't build another set
+        self.header_parsers = header_parsers
+        self.config = config
+        self._header_user_cache.clear()
+        self._refresh_digests.clear()
+        self.log.info(
+            "HeaderAuthenticator - reloaded the header config from: %s, "
+            "allowed_headers: %s",
+            config_file,
+            self.allowed_headers,
         )
-        user_data = {}
+
+    def _build_extraction_plan(self, allowed_headers=None, header_parsers=None):
+        """Compile the allowed_headers and header_parsers into an immutable
+        ordered tuple of (header name, parse callable, auth_state key, extract
+        callable, awaited) entries.
+        A parse callable of None means that the whole data object is stored.
+        The parse callable of an AsyncParser returns a coroutine that is
+        bounded by the parser's timeout, such entries are marked as awaited.
+        Entries that aren't awaited can be offloaded to the parser executor.
+        The extract callable returns the value that is parsed from the data,
+        it is None when the value is the header itself.
+        Since the auth_state is keyed by the header name, a header that is
+        listed under several allowed_headers keys is rejected"""
+        if allowed_headers is None:
+            allowed_headers = self.allowed_headers
+        if header_parsers is None:
+            header_parsers = self.header_parsers
+        duplicates = sorted(
+            header
+            for header, count in Counter(allowed_headers.values()).items()
+            if count > 1
+        )
+        if duplicates:
+            self.log.error(
+                "HeaderAuthenticator - the allowed_headers list the headers: %s "
+                "under more than one key",
+                duplicates,
+            )
+            raise ValueError(
+                "Duplicate header values in allowed_headers: {}".format(duplicates)
+            )
+        plan = []
+        for allowed_index, allowed_value in allowed_headers.items():
+            parser = header_parsers.get(allowed_index, None)
+            extract = None
+            if parser is None:
+                parse = None
+            elif isinstance(parser, AsyncParser):
+                parse = self._async_parse(parser, allowed_value)
+            else:
+                parse = parser.parse
+            if parser is not None and type(parser).extract is not Parser.extract:
+                extract = functools.partial(parser.extract, header=allowed_value)
+            awaited = parse is not None and inspect.iscoroutinefunction(parse)
+            plan.append((allowed_value, parse, allowed_value, extract, awaited))
+        return tuple(plan)
+
+    @staticmethod
+    def _value_size(value):
+        """The number of characters of a header value, or the total of its
+        chunks. Header values are decoded as latin-1, so this is their size
+        in bytes as received"""
+        if isinstance(value, tuple):
+            return sum(len(chunk) for chunk in value)
+        return len(value)
+
+    @staticmethod
+    def _plan_values(plan, data):
+        """The values of the extraction plan entries in the data,
+        a missing value is None"""
+        return [
+            data.get(header, None) if extract is None else extract(data) or None
+            for header, _, _, extract, _ in plan
+        ]
+
+    def _build_parse_observers(self, allowed_headers=None, header_parsers=None):
+        """Map the parsed headers to the observe method of their
+        HEADER_PARSE_DURATION_SECONDS allowed_headers key child.
+        The base Parser returns the header value as is, so it isn't timed"""
+        if allowed_headers is None:
+            allowed_headers = self.allowed_headers
+        if header_parsers is None:
+            header_parsers = self.header_parsers
+        observers = {}
+        for allowed_index, allowed_value in allowed_headers.items():
+            parser = header_parsers.get(allowed_index, None)
+            if parser is not None and type(parser) is not Parser:
+                observers[allowed_value] = HEADER_PARSE_DURATION_SECONDS.labels(
+                    header_key=allowed_index
+                ).observe
+        return observers
+
+    def _async_parse(self, parser, header):
+        async def parse(data):
+            try:
+                return await asyncio.wait_for(
+                    parser.parse(data), parser.timeout or None
+                )
+            except asyncio.TimeoutError:
+                self.log.error(
+                    "HeaderAuthenticator - %s timed out after %s seconds "
+                    "while parsing the: %s header",
+                    type(parser).__name__,
+                    parser.timeout,
+                    header,
+                )
+                return None
+
+        return parse
+
+    async def authenticate(self, handler, data):
+        start = time.perf_counter()
+        try:
+            user = await self._authenticate(handler, data)
+        except Exception:
+            AUTHENTICATE_FAILURE_DURATION_SECONDS.observe(time.perf_counter() - start)
+            raise
+        duration = time.perf_counter() - start
+        AUTHENTICATE_SUCCESS_DURATION_SECONDS.observe(duration)
+        timing = getattr(handler, "server_timing", None)
+        if timing is not None:
+            timing.add("authenticate", duration)
+        return user
+
+    async def _authenticate(self, handler, data):
+        if self.log.isEnabledFor(logging.DEBUG):
+            self.log.debug(
+                "HeaderAuthenticator - Request authentication with "
+                "handler: %s, data: %s of type: %s",
+                handler,
+                data,
+                type(data),
+            )
+            self.log.debug(
+                "HeaderAuthenticator allowed headers: %s", self.allowed_headers
+            )
+        plan = self._extraction_plan
+        cache = self._auth_result_cache
+        cache_key = None
+        if cache is not None and all(entry[1] is not None for entry in plan):
+            values = self._plan_values(plan, data)
+            cache_key = values_digest(values)
+            user = cache.get(cache_key)
+            if user is None:
+                user = await self._prepare_user(plan, data, handler)
+                # Don't cache a result of a plan that a reload replaced meanwhile
+                if plan is self._extraction_plan:
+                    cache.set(
+                        cache_key,
+                        user,
+                        weight=sum(self._value_size(value) for value in values if value)
+                        * 2,
+                    )
+            user = self._copy_user(user)
+        else:
+            user = await self._prepare_user(plan, data, handler)
+        refresh_digests = self._refresh_digests
+        if (cache_key is not None or refresh_digests) and self.auth_refresh_age:
+            # The digest is the login_key, which is only computed here when
+            # the result cache already has it, otherwise the first refresh
+            # computes it
+            name = self.normalize_username(user["name"])
+            if cache_key is not None:
+                refresh_digests.set(name, cache_key)
+            else:
+                refresh_digests.pop(name)
+
+        if not self.quiet_login_log:
+            self.log.info("Authenticated: %s - Login", user)
+        else:
+            num_logins = self.login_log_sampler.sample()
+            if num_logins:
+                self.log.info(
+                    "Authenticated: %s - Login (sampled 1 of %s logins)",
+                    user,
+                    num_logins,
+                )
+        return user
+
+    @staticmethod
+    def _copy_user(user):
+        """Copy a cached user model, since JupyterHub and a post_auth_hook
+        may update the returned dict and the parsed auth_state values"""
+        user = dict(user)
+        if "auth_state" in user:
+            user["auth_state"] = deepcopy(user["auth_state"])
+        return user
+
+    async def _prepare_user(self, plan, data, handler=None, login=True):
+        """Run the extraction plan on the data and return the user model,
+        the parse times are recorded in the handler's server_timing if set.
+        A missing 'auth' value is only counted as a login failure on login"""
+        # Read before the parses are awaited, such that a reload
+        # of the header config doesn't change it for this login
+        auth_key = self.allowed_headers["auth"]
+        executor = self._parser_executor
+        threshold = self.parser_offload_threshold if executor is not None else 0
+        observers = self._parse_observers
+        timing = getattr(handler, "server_timing", None)
+        prepared = []
+        # The indexes in prepared of the async and offloaded parses,
+        # which are awaited concurrently
+        pending = []
         # Process remaining allowed_headers, save valid in user_data
-        for allowed_index, allowed_value in self.allowed_headers.items():
-            auth_data = data.get(allowed_value, "")
+        for header, parse, state_key, extract, awaited in plan:
+            auth_data = data.get(header, "") if extract is None else extract(data)
             if auth_data:
-                prepared_data = None
-                if allowed_index in self.header_parsers:
-                    prepared_data = self.header_parsers[allowed_index].parse(auth_data)
+                if parse is not None:
+                    observe = observers.get(header, None)
+                    if timing is not None:
+                        observe = timing.observer("parse-" + header, observe)
+                    start = time.perf_counter() if observe is not None else 0
+                    if executor is None:
+                        prepared_data = parse(auth_data)
+                    elif not awaited and self._value_size(auth_data) > threshold:
+                        prepared_data = executor.run(parse, auth_data)
+                        awaited = True
+                    else:
+                        prepared_data = executor.run_inline(parse, auth_data)
+                    if awaited:
+                        if observe is not None:
+                            prepared_data = self._observe_parse(
+                                prepared_data, observe, start
+                            )
+                        pending.append(len(prepared))
+                    elif observe is not None:
+                        observe(time.perf_counter() - start)
                 else:
                     prepared_data = data
-                if prepared_data:
-                    user_data[allowed_value] = prepared_data
+                prepared.append((state_key, prepared_data))
 
+        if pending:
+            results = await asyncio.gather(*[prepared[index][1] for index in pending])
+            for index, result in zip(pending, results):
+                prepared[index] = (prepared[index][0], result)
+
+        user_data = self._user_data(prepared)
         self.log.debug(
-            "HeaderAuthenticator - Prepared user_data: {} "
-            "for auth check".format(user_data)
+            "HeaderAuthenticator - Prepared user_data: %s for auth check",
+            user_data,
         )
-        if self.allowed_headers["auth"] not in user_data:
+        if auth_key not in user_data:
+            if login:
+                if data.get(auth_key, None):
+                    reason = LoginFailureReason.missing_username
+                else:
+                    reason = LoginFailureReason.missing_header
+                LOGIN_FAILURES.labels(reason=reason).inc()
             self.log.error(
                 "HeaderAuthenticator - Failed to find the 'auth' key "
                 "in the user_data dictionary, this is required "
                 "to set the authenticated user's username"
             )
-            raise web.HTTPError(
-                401,
-                "Authentication failed, "
-                "missing information to authenticate you with.",
-            )
+            raise self._missing_auth_error()
+        return self._user_model(user_data, auth_key)
 
-        user = {"name": user_data.pop(self.allowed_headers["auth"], None)}
+    @staticmethod
+    def _user_data(prepared):
+        """Keep the (auth_state key, prepared data) pairs that have a value"""
+        user_data = {}
+        for state_key, prepared_data in prepared:
+            if prepared_data:
+                user_data[state_key] = prepared_data
+        return user_data
+
+    def _user_model(self, user_data, auth_key):
+        user = {"name": user_data.pop(auth_key, None)}
         # Something left in user_data, put in auth_state
         if user_data:
+            threshold = self.auth_state_compression_threshold
+            if threshold > 0:
+                user_data = {
+                    key: compress_value(value, threshold)
+                    for key, value in user_data.items()
+                }
             user.update({"auth_state": user_data})
+        return user
+
+    @staticmethod
+    def _missing_auth_error():
+        return web.HTTPError(
+            401,
+            "Authentication failed, missing information to authenticate you with.",
+        )
+
+    async def authenticate_many(self, header_maps, batch_size=256):
+        """Authenticate an iterable of header maps, e.g. for pre-provisioning or
+        replaying captured headers. Yields the user model of each header map in
+        order, or the exception that authenticate would have raised for it.
+        Identical header values are only parsed once per batch, and every
+        further user model of the batch gets a copy of the parsed value"""
+        batch = []
+        for data in header_maps:
+            batch.append(data)
+            if len(batch) >= batch_size:
+                for result in await self._authenticate_batch(batch):
+                    yield result
+                batch = []
+        if batch:
+            for result in await self._authenticate_batch(batch):
+                yield result
+
+    async def _authenticate_batch(self, batch):
+        plan = self._extraction_plan
+        auth_key = self.allowed_headers["auth"]
+        # The parsed value, or raised exception, of each (plan index, header value)
+        parsed = {}
+        pending = []
+        for data in batch:
+            for index, (header, parse, _, extract, awaited) in enumerate(plan):
+                auth_data = data.get(header, "") if extract is None else extract(data)
+                if parse is None or not auth_data or (index, auth_data) in parsed:
+                    continue
+                try:
+                    parsed_data = parse(auth_data)
+                except Exception as err:
+                    parsed_data = err
+                if awaited:
+                    pending.append((index, auth_data))
+                parsed[(index, auth_data)] = parsed_data
+
+        if pending:
+            results = await asyncio.gather(
+                *[parsed[key] for key in pending], return_exceptions=True
+            )
+            for key, result in zip(pending, results):
+                parsed[key] = result
+        self.log.debug(
+            "HeaderAuthenticator - Parsed a batch of: %s header maps "
+            "with: %s unique header values",
+            len(batch),
+            len(parsed),
+        )
+
+        results = []
+        # The parsed values that are already part of a result, later results
+        # get a copy so that their auth_state values don't alias each other
+        used = set()
+        for data in batch:
+            prepared = []
+            for index, (header, parse, state_key, extract, _) in enumerate(plan):
+                auth_data = data.get(header, "") if extract is None else extract(data)
+                if auth_data:
+                    if parse is not None:
+                        parsed_data = parsed[(index, auth_data)]
+                        if (index, auth_data) in used and not isinstance(
+                            parsed_data, Exception
+                        ):
+                            parsed_data = deepcopy(parsed_data)
+                        used.add((index, auth_data))
+                        prepared.append((state_key, parsed_data))
+                    else:
+                        prepared.append((state_key, data))
+            errors = [
+                prepared_data
+                for _, prepared_data in prepared
+                if isinstance(prepared_data, Exception)
+            ]
+            if errors:
+                results.append(errors[0])
+                continue
+            user_data = self._user_data(prepared)
+            if auth_key not in user_data:
+                results.append(self._missing_auth_error())
+            else:
+                results.append(self._user_model(user_data, auth_key))
+        return results
+
+    @property
+    def header_users_resolvable(self):
+        """Whether get_header_user can resolve users synchronously, which
+        requires that the 'auth' header parser and the user checks
+        aren't asynchronous"""
+        return not (
+            isinstance(self.header_parsers.get("auth", None), AsyncParser)
+            or inspect.iscoroutinefunction(self.check_blocked_users)
+            or inspect.iscoroutinefunction(self.check_allowed)
+        )
 
-        self.log.info("Authenticated: {} - Login".format(user))
+    def get_header_user(self, handler, header_value):
+        """Resolve the existing user of the 'auth' header value, returns None if
+        the user doesn't exist yet, the header value can't be parsed, or the
+        user is blocked or no longer allowed, in which case the user has to
+        login. Requires that header_users_resolvable is True"""
+        user = self._header_user_cache.get(header_value)
+        if user is None:
+            parser = self.header_parsers.get("auth", None)
+            name = header_value if parser is None else parser.parse(header_value)
+            if not name:
+                return None
+            username = self.normalize_username(name)
+            user = handler.find_user(username)
+            if user is None:
+                return None
+            # Same as a login, except that the user already exists
+            if not self.check_blocked_users(username, None):
+                self.log.warning(
+                    "HeaderAuthenticator - the 'auth' header user: %s is blocked",
+                    username,
+                )
+                return None
+            if not (self.allow_all or self.check_allowed(username, None)):
+                self.log.warning(
+                    "HeaderAuthenticator - the 'auth' header user: %s is not allowed",
+                    username,
+                )
+                return None
+            self._header_user_cache.set(header_value, user)
+        self._record_header_activity(handler, user)
         return user
 
+    @staticmethod
+    def _record_header_activity(handler, user):
+        """Same as the login cookie, update the user activity at most once
+        every activity_resolution seconds"""
+        now = utcnow(with_tz=False)
+        resolution = handler.settings.get("activity_resolution", 0)
+        if (
+            user.last_activity
+            and resolution
+            and (now - user.last_activity).total_seconds() <= resolution
+        ):
+            return
+        user.last_activity = now
+        handler.db.commit()
+
+    @staticmethod
+    async def _observe_parse(parsing, observe, start):
+        try:
+            return await parsing
+        finally:
+            observe(time.perf_counter() - start)
+
+    def login_retry_after(self, data):
+        """Take a login token for the 'auth' header value and a global login
+        token, returns 0 if the login is allowed, otherwise the number of
+        seconds until it can be retried"""
+        if self._login_limiter is not None:
+            retry_after = self._login_limiter.acquire(
+                data.get(self.allowed_headers["auth"], None)
+            )
+            if retry_after:
+                return retry_after
+        if self._global_login_limiter is not None:
+            return self._global_login_limiter.acquire()
+        return 0
+
+    def login_key(self, data):
+        """The key that concurrent logins are coalesced by,
+        a digest of the allowed_headers values"""
+        return values_digest(self._plan_values(self._extraction_plan, data))
+
+    async def refresh_user(self, user, handler=None):
+        """Refresh the user's auth_state from the headers of the current request,
+        called by JupyterHub at most once every auth_refresh_age seconds, and
+        before a spawn or stop.
+        Returns True when the allowed_headers values are unchanged since the
+        user's last refresh, or are missing from the request, or when the
+        request is made by another user, e.g. an admin that spawns the user's
+        server. Otherwise the headers are parsed again and the new auth_state
+        is returned, or False if the headers now identify a different user"""
+        request = getattr(handler, "request", None)
+        if request is None:
+            return True
+        data = request.headers
+        if not data.get(self.allowed_headers["auth"], None):
+            return True
+        current_user = getattr(handler, "_jupyterhub_user", None)
+        if current_user is not None and current_user.name != user.name:
+            return True
+        digest = self.login_key(data)
+        known_digest = self._refresh_digests.get(user.name)
+        if known_digest == digest:
+            return True
+        try:
+            refreshed = await self._prepare_user(
+                self._extraction_plan, data, login=False
+            )
+        except web.HTTPError:
+            return False
+        if self.normalize_username(refreshed["name"]) != user.name:
+            self.log.warning(
+                "HeaderAuthenticator - the headers of: %s identify another user "
+                "on refresh, login is required",
+                user.name,
+            )
+            return False
+        self._refresh_digests.set(user.name, digest)
+        auth_state = refreshed.get("auth_state", None)
+        if known_digest is None and auth_state == await user.get_auth_state():
+            # The first refresh since the login, with the login's headers
+            return True
+        if auth_state is not None:
+            unchanged, auth_state_digest = self.auth_state_unchanged(
+                user.name, auth_state
+            )
+            if self.skip_unchanged_auth_state:
+                if unchanged:
+                    return True
+                self.remember_auth_state(user.name, auth_state_digest)
+        else:
+            # The headers no longer produce an auth_state, which clears it
+            self._auth_state_digests.pop(user.name)
+        self.forget_cached_auth_state(user.name)
+        self.log.debug(
+            "HeaderAuthenticator - refreshed the auth_state of: %s",
+            user.name,
+        )
+        return {"name": user.name, "auth_state": auth_state}
+
+    def auth_state_unchanged(self, name, auth_state):
+        """Checks whether the auth_state is the same as the one that
+        was last stored for the user.
+        Returns a tuple of the result and the digest of the auth_state"""
+        digest = content_digest(auth_state)
+        return self._auth_state_digests.get(name) == digest, digest
+
+    def remember_auth_state(self, name, digest):
+        """Record the digest of the auth_state that was stored for the user"""
+        self._auth_state_digests.set(name, digest)
+
+    def forget_cached_auth_state(self, name):
+        """Drop the cached decrypted auth_state of the user, called when
+        a new auth_state has been stored"""
+        self._auth_state_generation += 1
+        self._auth_state_flight.forget(name)
+        if self._auth_state_cache is not None:
+            self._auth_state_cache.pop(name)
+
+    async def _load_auth_state(self, user):
+        generation = self._auth_state_generation
+        auth_state = self.decompress_auth_state(await user.get_auth_state())
+        if (
+            auth_state is not None
+            and self._auth_state_cache is not None
+            and generation == self._auth_state_generation
+        ):
+            self._auth_state_cache.set(user.name, auth_state)
+        return auth_state
+
+    @staticmethod
+    def decompress_auth_state(auth_state):
+        """Returns the auth_state with its compressed values decompressed,
+        an auth_state without compressed values is returned as is"""
+        if not auth_state or not any(
+            isinstance(value, str) and value.startswith(COMPRESSED_VALUE_PREFIX)
+            for value in auth_state.values()
+        ):
+            return auth_state
+        return {key: decompress_value(value) for key, value in auth_state.items()}
+
+    async def get_auth_state(self, user):
+        """Returns the user's decrypted auth_state, concurrent calls for
+        the same user share a single decryption"""
+        if self._auth_state_cache is None:
+            return self.decompress_auth_state(await user.get_auth_state())
+        auth_state = self._auth_state_cache.get(user.name)
+        if auth_state is None:
+            auth_state = await self._auth_state_flight.run(
+                user.name, self._load_auth_state, user
+            )
+        return auth_state
+
     async def pre_spawn_start(self, user, spawner):
         """Pass upstream_token to spawner via environment variable"""
-        auth_state = await user.get_auth_state()
+        start = time.perf_counter()
+        try:
+            await self._pre_spawn_start(user, spawner)
+        finally:
+            PRE_SPAWN_START_DURATION_SECONDS.observe(time.perf_counter() - start)
+
+    async def _pre_spawn_start(self, user, spawner):
+        auth_state = await self.get_auth_state(user)
         if not auth_state:
             self.log.debug(
-                "HeaderAuthenticator - pre_spawn_hook, "
-                "auth_state: {}".format(auth_state)
+                "HeaderAuthenticator - pre_spawn_hook, auth_state: %s",
+                auth_state,
             )
             # auth_state not enabled
             return
 
         self.log.debug(
-            "HeaderAuthenticator - pre_spawn_hook, "
-            "loaded auth_state {}".format(auth_state)
+            "HeaderAuthenticator - pre_spawn_hook, loaded auth_state %s",
+            auth_state,
         )
         # Share permitted headers
-        if not self.spawner_shared_headers:
+        projection = self._env_projection
+        if not projection:
             self.log.debug(
                 "HeaderAuthenticator - no headers were "
-                "shared with spawner environment: {}".format(
-                    self.spawner_shared_headers
-                )
+                "shared with spawner environment: %s",
+                self.spawner_shared_headers,
             )
             return
 
-        for auth_key, auth_val in auth_state.items():
-            if auth_key in self.spawner_shared_headers:
-                spawner.environment[auth_key] = auth_val
+        max_size = self.spawner_env_max_value_size
+        for auth_key, tokens, env_name, encode in projection:
+            if auth_key not in auth_state:
+                continue
+            auth_val = auth_state[auth_key]
+            if tokens:
+                auth_val = resolve_pointer(auth_val, tokens)
+                if auth_val is None:
+                    continue
+            if encode and not isinstance(auth_val, str):
+                auth_val = json.dumps(auth_val, separators=(",", ":"))
+            if max_size and isinstance(auth_val, str) and len(auth_val) > max_size:
+                self.log.warning(
+                    "HeaderAuthenticator - skipped sharing: %s with the spawner "
+                    "environment, the value size: %s exceeds the "
+                    "spawner_env_max_value_size: %s",
+                    env_name,
+                    len(auth_val),
+                    max_size,
+                )
+                continue
+            spawner.environment[env_name] = auth_val
         self.log.debug(
-            "HeaderAuthenticator - shared auth_state headers: {} with "
-            "spawner environment: {}".format(
-                self.spawner_shared_headers, spawner.environment
-            )
+            "HeaderAuthenticator - shared auth_state headers: %s with "
+            "spawner environment: %s",
+            [env_name for _, _, env_name, _ in projection],
+            spawner.environment,
         )
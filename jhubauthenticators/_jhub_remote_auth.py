@@ -41,7 +41,7 @@ class DataHandler(BaseHandler):
         if not user_data:
             raise web.HTTPError(403, "No valid data header was received")
 
-        self.log.debug("Prepared user_data dict: {}".format(user_data))
+        self.log.debug("Prepared user_data dict: %s", user_data)
         user = await self.get_current_user()
         for k, d in user_data.items():
             # Try to parse the passed information into a valid dtype
@@ -49,13 +49,14 @@ class DataHandler(BaseHandler):
                 evaled_data = literal_eval(d)
             except ValueError as err:
                 msg = "Failed to interpret the data header"
-                self.log.error("User: {} - {}-{}-{}".format(user, d, msg, err))
+                self.log.error("User: %s - %s-%s-%s", user, d, msg, err)
                 raise web.HTTPError(403, msg)
 
             self.log.debug(
-                "User: {}-{} Accepted data header: {}".format(
-                    user, user.name, evaled_data
-                )
+                "User: %s-%s Accepted data header: %s",
+                user,
+                user.name,
+                evaled_data,
             )
 
             if not hasattr(user, "data"):
@@ -1,12 +1,36 @@
+import functools
 import json
+import math
 from json import JSONDecodeError
-from re import search
+import re
+import threading
+import time
 from tornado import web
-from tornado.escape import json_decode
+from tornado.escape import json_decode, url_escape
+from tornado.httpclient import AsyncHTTPClient, HTTPClientError
 from jupyterhub.handlers import BaseHandler
 from jupyterhub.utils import url_path_join, maybe_future
-from traitlets import CRegExp, Dict
+from traitlets import (
+    Bool,
+    CaselessStrEnum,
+    CRegExp,
+    Dict,
+    Float,
+    Integer,
+    List,
+    Unicode,
+    observe,
+)
 from traitlets.config import LoggingConfigurable
+from ._cache import LRUCache
+from ._compression import DecompressionError, decompress_chunks
+from ._jsonpointer import compile_projection, project
+from ._metrics import LOGIN_FAILURES, USER_DATA_SIZE_BYTES, LoginFailureReason
+from ._timing import ServerTiming
+
+# Pre-rendered, such that header-less probes skip the error template
+MISSING_HEADER_BODY = b"401: Unauthorized, missing authentication header\n"
+RATE_LIMITED_BODY = b"429: Too Many Requests\n"
 
 
 class HeaderLoginHandler(BaseHandler):
@@ -14,6 +38,10 @@ class HeaderLoginHandler(BaseHandler):
     Class that is used to handle whether the user is authenticated or not
     """
 
+    # The stage timings of the login, recorded when the authenticator
+    # has login_server_timing or login_timing_log enabled
+    server_timing = None
+
     async def prepare(self):
         """Checks whether the user is authenticated, if so
         the user is redirected to / hub.server.base_url / home"""
@@ -24,7 +52,7 @@ class HeaderLoginHandler(BaseHandler):
         user = self.current_user
         if user:
             if hasattr(user, "name"):
-                self.log.info("User: {} is already authenticated".format(user.name))
+                self.log.info("User: %s is already authenticated", user.name)
 
             argument = self.get_argument("next", None, True)
             if argument:
@@ -34,9 +62,25 @@ class HeaderLoginHandler(BaseHandler):
         else:
             # You need to authenticate first
             headers = self.request.headers
+            authenticator = self.authenticator
+            if authenticator.reject_missing_auth_header and not headers.get(
+                authenticator.allowed_headers["auth"], None
+            ):
+                self.reject_missing_auth_header()
+                return
+            retry_after = authenticator.login_retry_after(headers)
+            if retry_after:
+                self.reject_rate_limited(retry_after)
+                return
+            if authenticator.login_server_timing or authenticator.login_timing_log:
+                self.server_timing = ServerTiming()
             # Authenticate user
-            user = await self.login_user(headers)
+            start = time.perf_counter()
+            user = await self.coalesced_login_user(headers)
+            if self.server_timing is not None:
+                self.server_timing.add("login", time.perf_counter() - start)
             if not user:
+                LOGIN_FAILURES.labels(reason=LoginFailureReason.not_allowed).inc()
                 raise web.HTTPError(
                     401,
                     "The specified authentication method failed "
@@ -46,9 +90,123 @@ class HeaderLoginHandler(BaseHandler):
 
             argument = self.get_argument("next", None, True)
             if argument:
-                self.redirect(argument)
+                next_url = argument
             else:
-                self.redirect(url_path_join(self.hub.server.base_url, "home"))
+                next_url = url_path_join(self.hub.server.base_url, "home")
+            # The redirect sends the header, so it can't be timed in it
+            if self.server_timing is not None:
+                self.finish_server_timing(user)
+            self.redirect(next_url)
+
+    def finish_server_timing(self, user):
+        """Emit the recorded stage timings as a Server-Timing
+        header and or a debug log line"""
+        authenticator = self.authenticator
+        timing = self.server_timing.header_value()
+        if authenticator.login_server_timing:
+            self.set_header("Server-Timing", timing)
+        if authenticator.login_timing_log:
+            self.log.debug(
+                "HeaderLoginHandler - login of: %s, stage timings: %s",
+                user.name,
+                timing,
+            )
+
+    def reject_missing_auth_header(self):
+        """Finish the request with a tiny 401 response before login_user is
+        called, the error log is rate limited by the authenticator"""
+        authenticator = self.authenticator
+        authenticator.missing_header_rejections += 1
+        LOGIN_FAILURES.labels(reason=LoginFailureReason.missing_header).inc()
+        suppressed = authenticator.missing_header_log_limiter.acquire()
+        if suppressed is not None:
+            self.log.error(
+                "HeaderLoginHandler - rejected a login without the: %s header "
+                "from: %s, %s similar rejections were not logged",
+                authenticator.allowed_headers["auth"],
+                self.request.remote_ip,
+                suppressed,
+            )
+        self.set_status(401)
+        self.set_header("Content-Type", "text/plain; charset=UTF-8")
+        self.finish(MISSING_HEADER_BODY)
+
+    def reject_rate_limited(self, retry_after):
+        """Finish the request with a tiny 429 response before login_user
+        is called"""
+        self.log.debug(
+            "HeaderLoginHandler - rate limited a login from: %s, retry after: %s",
+            self.request.remote_ip,
+            retry_after,
+        )
+        self.set_status(429)
+        self.set_header("Retry-After", str(math.ceil(retry_after)))
+        self.set_header("Content-Type", "text/plain; charset=UTF-8")
+        self.finish(RATE_LIMITED_BODY)
+
+    async def coalesced_login_user(self, headers):
+        """Concurrent logins with the same allowed headers await a single
+        login_user call, after which each request sets its own login cookie"""
+        authenticator = self.authenticator
+        if not authenticator.coalesce_concurrent_logins:
+            return await self.login_user(headers)
+
+        key = authenticator.login_key(headers)
+        login_flight = authenticator.login_flight
+        # The first request runs the login_user call, which sets its cookie
+        leader = key not in login_flight
+        user = await login_flight.run(key, self.login_user, headers)
+        if user and not leader:
+            self.log.debug(
+                "HeaderLoginHandler - %s shared a concurrent login",
+                user.name,
+            )
+            self.set_login_cookie(user)
+        return user
+
+    async def auth_to_user(self, authenticated, user=None):
+        """Skips re-encrypting and storing the auth_state when the authenticator
+        has seen the same auth_state being stored for the user before.
+        Otherwise the authenticator's cached decrypted auth_state is dropped"""
+        authenticator = self.authenticator
+        if not authenticator.skip_unchanged_auth_state:
+            user = await super().auth_to_user(authenticated, user=user)
+            authenticator.forget_cached_auth_state(user.name)
+            return user
+
+        name = authenticated["name"]
+        auth_state = authenticated.get("auth_state", None)
+        if not authenticator.enable_auth_state:
+            auth_state = None
+        unchanged, digest = authenticator.auth_state_unchanged(name, auth_state)
+        existing = user if user is not None else self.find_user(name)
+        if (
+            unchanged
+            and existing is not None
+            and (existing.encrypted_auth_state is None) == (auth_state is None)
+        ):
+            self.log.debug(
+                "HeaderLoginHandler - auth_state of: %s is unchanged, "
+                "skipping the encrypt and store",
+                name,
+            )
+
+            async def keep_auth_state(auth_state):
+                # Still commit any other changes made to the user
+                self.db.commit()
+
+            # auth_to_user always ends with user.save_auth_state, which
+            # would re-encrypt and write the unchanged auth_state
+            existing.save_auth_state = keep_auth_state
+            try:
+                return await super().auth_to_user(authenticated, user=existing)
+            finally:
+                del existing.save_auth_state
+
+        user = await super().auth_to_user(authenticated, user=user)
+        authenticator.remember_auth_state(name, digest)
+        authenticator.forget_cached_auth_state(user.name)
+        return user
 
 
 class UserDataHandler(BaseHandler):
@@ -60,36 +218,37 @@ class UserDataHandler(BaseHandler):
     @web.authenticated
     async def post(self):
         user = await self.get_current_user()
+        USER_DATA_SIZE_BYTES.observe(len(self.request.body))
         self.log.debug(
-            "UserDataHandler - Request: {}, "
-            "Body: {}".format(self.request, self.request.body)
+            "UserDataHandler - Request: %s, Body: %s",
+            self.request,
+            self.request.body,
         )
         data = None
         try:
             data = json_decode(self.request.body)
         except JSONDecodeError as err:
             self.log.error(
-                "UserDataHandler - Failed to json decode: {}, err: {}".format(data, err)
+                "UserDataHandler - Failed to json decode: %s, err: %s", data, err
             )
             raise web.HTTPError(500, "Failed to parse user data input")
 
         if not data:
             self.log.debug(
-                "UserDataHandler - no json data was received: {}".format(
-                    self.request.json
-                )
+                "UserDataHandler - no json data was received: %s",
+                self.request.body,
             )
             raise web.HTTPError(
                 403, "No data was recieved that can be used" " to set an attribute"
             )
-        self.log.debug(
-            "UserDataHandler - Received: {} as a user json data post".format(data)
-        )
+        self.log.debug("UserDataHandler - Received: %s as a user json data post", data)
 
         if not isinstance(data, dict):
             self.log.error(
                 "UserDataHandler - invalid internal json post structure, "
-                "expects: {}, recieved: {}".format(dict, type(data))
+                "expects: %s, recieved: %s",
+                dict,
+                type(data),
             )
             raise web.HTTPError(403, "An invalid data type was recieved")
 
@@ -109,19 +268,160 @@ class UserDataHandler(BaseHandler):
                     setattr(user, valid_attr, data_val)
                 except AttributeError as err:
                     self.log.error(
-                        "UserDataHandler - Failed to set attribute: {} "
-                        "to value: {}, err: {}".format(
-                            "self.spawner.user." + valid_attr, data_val, err
-                        )
+                        "UserDataHandler - Failed to set attribute: %s "
+                        "to value: %s, err: %s",
+                        "self.spawner.user." + valid_attr,
+                        data_val,
+                        err,
                     )
             else:
                 self.log.debug(
-                    "UserDataHandler - {} was not found "
-                    "recieved data: {}".format(valid_attr, data)
+                    "UserDataHandler - %s was not found recieved data: %s",
+                    valid_attr,
+                    data,
                 )
 
 
+class HeaderConfigReloadHandler(BaseHandler):
+    """
+    Handles the post requests where an admin reloads the header configuration
+    of the HeaderAuthenticator without restarting the hub.
+    """
+
+    @web.authenticated
+    async def post(self):
+        user = self.current_user
+        if not user.admin:
+            raise web.HTTPError(403, "Only admins can reload the header config")
+        try:
+            self.authenticator.reload_header_config()
+        except Exception as err:
+            self.log.error(
+                "HeaderConfigReloadHandler - Failed to reload the header config, "
+                "keeping the previous config: %s",
+                err,
+            )
+            raise web.HTTPError(
+                400, "Failed to reload the header config: {}".format(err)
+            )
+        self.finish(
+            {
+                "allowed_headers": self.authenticator.allowed_headers,
+                "header_parser_classes": {
+                    parser_key: parser_class.__name__
+                    for parser_key, parser_class in (
+                        self.authenticator.header_parser_classes.items()
+                    )
+                },
+            }
+        )
+
+
+def install_header_bound_sessions():
+    """Wrap the BaseHandler.get_current_user_cookie, such that the hub resolves
+    the current user from the trusted 'auth' header on every request when the
+    authenticator has header_bound_sessions enabled, without the /login
+    redirect and cookie round-trip. Requests without the header, and
+    headers that can't be resolved synchronously, fall back to the login
+    cookie.
+    JupyterHub has no per-application hook for this, so the wrapper is
+    installed once for the whole process and stays installed. It only
+    acts for the handlers of hubs whose authenticator enables
+    header_bound_sessions, every other handler gets the original method"""
+    get_current_user_cookie = BaseHandler.get_current_user_cookie
+    if getattr(get_current_user_cookie, "header_bound", False):
+        return
+
+    @functools.wraps(get_current_user_cookie)
+    def get_current_user_header(self):
+        authenticator = self.authenticator
+        if (
+            getattr(authenticator, "header_bound_sessions", False)
+            and authenticator.header_users_resolvable
+        ):
+            header_value = self.request.headers.get(
+                authenticator.allowed_headers["auth"], None
+            )
+            if header_value:
+                # The header decides, also when it doesn't match the cookie
+                user = authenticator.get_header_user(self, header_value)
+                if user and not self.get_session_cookie():
+                    # As for cookie-authenticated requests
+                    self.set_session_cookie()
+                return user
+        return get_current_user_cookie(self)
+
+    get_current_user_header.header_bound = True
+    BaseHandler.get_current_user_cookie = get_current_user_header
+
+
+def compile_replace_chars(replace_chars):
+    """Compile a replace_extract_chars dict into a single callable.
+    Single character replacements are merged into one str.translate table,
+    which gives the same result as replacing them one by one as long as no
+    replacement value introduces another key. Otherwise the replacements
+    are applied in order."""
+    if not replace_chars:
+        return None
+    items = tuple(replace_chars.items())
+    keys = "".join(key for key, _ in items if isinstance(key, str))
+    translatable = all(
+        isinstance(key, str)
+        and len(key) == 1
+        and isinstance(val, str)
+        and not any(char in keys for char in val)
+        for key, val in items
+    )
+    if translatable:
+        table = str.maketrans(dict(items))
+
+        def translate(value):
+            return value.translate(table)
+
+        return translate
+
+    def replace(value):
+        for replace_key, replace_val in items:
+            value = value.replace(replace_key, replace_val)
+        return value
+
+    return replace
+
+
+def compile_username_patterns(patterns, replace_chars=None):
+    """Compile an ordered list of username extract patterns, which are searched
+    in order until one matches. Returns a tuple of (compiled regex, name,
+    replace chars, replacer) entries"""
+    compiled = []
+    for pattern in patterns:
+        if isinstance(pattern, dict):
+            regex = pattern.get("regex", None)
+            name = pattern.get("name", None)
+            pattern_replace_chars = pattern.get("replace_extract_chars", replace_chars)
+        else:
+            regex, name, pattern_replace_chars = pattern, None, replace_chars
+        if not regex or not isinstance(regex, (str, re.Pattern)):
+            raise ValueError(
+                "Username extract pattern: {} requires a 'regex' string".format(pattern)
+            )
+        regex = re.compile(regex)
+        compiled.append(
+            (
+                regex,
+                name or regex.pattern,
+                pattern_replace_chars,
+                compile_replace_chars(pattern_replace_chars),
+            )
+        )
+    return tuple(compiled)
+
+
 class Parser(LoggingConfigurable):
+    def extract(self, data, header):
+        """Returns the value of the header that is passed to parse,
+        parsers can override this to read the value from several headers"""
+        return data.get(header, "")
+
     def parse(self, data):
         return data
 
@@ -146,62 +446,164 @@ class RegexUsernameParser(Parser):
         """,
     ).tag(config=True)
 
+    username_extract_patterns = List(
+        trait=Dict(),
+        default_value=[],
+        help="""Ordered list of username extract patterns that are compiled once
+        and searched in order, where the first pattern in the list that matches
+        the header is used. Each pattern is a dict with a 'regex' that has one
+        capture group, an optional 'name' that is used to count the matches in
+        pattern_match_counts, and an optional 'replace_extract_chars' dict that
+        overrides the default replace_extract_chars for that pattern.
+
+        E.g: accept both emails and x509 DNs
+        username_extract_patterns = [
+            {'name': 'email', 'regex': '([a-zA-Z0-9_.+-]+@[a-zA-Z0-9-.]+)',
+             'replace_extract_chars': {'@': '_', '.': '_'}},
+            {'name': 'x509', 'regex': '/CN=([^/]+)'},
+        ]
+
+        When set, the username_extract_patterns are used instead of
+        the username_extract_regex.
+        """,
+    ).tag(config=True)
+
+    cache_size = Integer(
+        default_value=0,
+        help="""The maximum number of header values whose parsed username is cached,
+        0 disables the cache.
+        """,
+    ).tag(config=True)
+
+    cache_ttl = Float(
+        default_value=600.0,
+        help="""The number of seconds a cached username is valid for,
+        0 disables the expiry.
+        """,
+    ).tag(config=True)
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._counts_lock = threading.Lock()
+        self._compile_patterns()
+        self._cache = self._new_cache()
+
+    def _compile_patterns(self):
+        if self.username_extract_patterns:
+            patterns = self.username_extract_patterns
+        elif self.username_extract_regex is not None:
+            patterns = [self.username_extract_regex]
+        else:
+            patterns = []
+        self._username_patterns = compile_username_patterns(
+            patterns, self.replace_extract_chars
+        )
+        self.pattern_match_counts = {
+            pattern[1]: 0 for pattern in self._username_patterns
+        }
+
+    def _new_cache(self):
+        if self.cache_size > 0:
+            return LRUCache(max_size=self.cache_size, ttl=self.cache_ttl)
+        return None
+
+    @observe("cache_size", "cache_ttl")
+    def _cache_config_changed(self, change):
+        self._cache = self._new_cache()
+
+    @observe(
+        "username_extract_regex", "username_extract_patterns", "replace_extract_chars"
+    )
+    def _extract_config_changed(self, change):
+        self._compile_patterns()
+        self._cache = self._new_cache()
+
+    def _count_match(self, name):
+        # Parses may run concurrently in the parser executor threads
+        with self._counts_lock:
+            self.pattern_match_counts[name] += 1
+
+    @property
+    def cache_hits(self):
+        if self._cache is None:
+            return 0
+        return self._cache.hits
+
+    @property
+    def cache_misses(self):
+        if self._cache is None:
+            return 0
+        return self._cache.misses
+
     def parse(self, data):
         if not data:
             self.log.error(
-                "RegexUsernameParser - Didn't "
-                "receive any input missing data: {}".format(data)
+                "RegexUsernameParser - Didn't receive any input missing data: %s", data
             )
             return None
 
         if not isinstance(data, str):
             self.log.error(
                 "RegexUsernameParser - Incorrect type was attempted to "
-                "be parsed, requires str but "
-                "data is of type: {}".format(type(data))
+                "be parsed, requires str but data is of type: %s",
+                type(data),
             )
             return None
 
+        if self._cache is not None:
+            cached = self._cache.get(data)
+            if cached is not None:
+                username, name = cached
+                self._count_match(name)
+                return username
+
         username = data
-        match = search(self.username_extract_regex, username)
-        if not match:
+        for regex, name, replace_chars, replacer in self._username_patterns:
+            match = regex.search(username)
+            if match:
+                break
+        else:
             self.log.error(
                 "RegexUsernameParser - Failed to find a valid "
-                "regex match with pattern: {} in {}".format(
-                    self.username_extract_regex, username
-                )
+                "regex match with pattern: %s in %s",
+                [pattern[1] for pattern in self._username_patterns],
+                username,
             )
             return None
+        self._count_match(name)
         groups = match.groups()
         if not groups:
             self.log.error(
                 "RegexUsernameParser - No username_extract_regex "
-                "matches found in: {}".format(username)
+                "matches found in: %s",
+                username,
             )
             return None
         if len(groups) > 1:
             self.log.error(
                 "RegexUsernameParser - username_extract_regex "
-                "More than 1 match was found in: {}".format(username)
+                "More than 1 match was found in: %s",
+                username,
             )
             return None
         username = groups[0]
         self.log.debug(
-            "RegexUsernameParser - Found username_extract_regex "
-            "matched: {}".format(username)
+            "RegexUsernameParser - Found username_extract_regex matched: %s",
+            username,
         )
 
-        if self.replace_extract_chars:
+        if replacer is not None:
             self.log.debug(
-                "RegexUsernameParser - replace_extract_chars "
-                "{}".format(self.replace_extract_chars)
+                "RegexUsernameParser - replace_extract_chars %s",
+                replace_chars,
             )
-            for replace_key, replace_val in self.replace_extract_chars.items():
-                username = username.replace(replace_key, replace_val)
+            username = replacer(username)
             self.log.info(
-                "RegexUsernameParser - username post replace_extract_chars: "
-                " {}".format(username)
+                "RegexUsernameParser - username post replace_extract_chars: %s",
+                username,
             )
+        if self._cache is not None and username:
+            self._cache.set(data, (username, name))
         return username
 
 
@@ -209,21 +611,213 @@ class JSONParser(Parser):
 
     json_types = (str, bytes, bytearray)
 
+    projection = List(
+        trait=Unicode(),
+        default_value=[],
+        help="""List of JSON pointers, or top level keys, of the fields that are
+        kept from the parsed JSON object, the rest is discarded before it is
+        stored in the auth_state. The kept fields retain their path, and objects
+        that a pointer descends into by an array index are kept whole.
+        An empty list keeps the whole object.
+
+        E.g: keep the subject, the groups and the email claim
+        projection = ['sub', '/groups', '/claims/email']
+        """,
+    ).tag(config=True)
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._projection = compile_projection(self.projection)
+
+    @observe("projection")
+    def _projection_changed(self, change):
+        self._projection = compile_projection(self.projection)
+
+    def _loads(self, data):
+        json_obj = json.loads(data)
+        if self._projection:
+            return project(json_obj, self._projection)
+        return json_obj
+
     def parse(self, data):
         if not data:
             self.log.error(
-                "JSONParser - Didn't " "receive any input missing data: {}".format(data)
+                "JSONParser - Didn't receive any input missing data: %s", data
             )
             return None
-        self.log.debug("JSONParser - Data: {}, type: {}".format(data, type(data)))
+        self.log.debug("JSONParser - Data: %s, type: %s", data, type(data))
         if not isinstance(data, JSONParser.json_types):
             self.log.error(
-                "JSONParser - data: {} is of an incorrect type: {} "
-                "must be one of type: {}".format(
-                    data, type(data), JSONParser.json_types
-                )
+                "JSONParser - data: %s is of an incorrect type: %s "
+                "must be one of type: %s",
+                data,
+                type(data),
+                JSONParser.json_types,
             )
             return None
 
-        json_obj = json.loads(data)
-        return json_obj
+        return self._loads(data)
+
+
+class CompressedJSONParser(JSONParser):
+    """
+    Parses JSON that is compressed and base64url encoded, optionally split
+    across numbered headers, e.g. JsonData-1, JsonData-2, ... when the
+    payload is larger than the proxy's header size limit.
+    """
+
+    compression = CaselessStrEnum(
+        ["zlib", "deflate", "gzip"],
+        default_value="zlib",
+        help="""The compression format of the payload, either 'zlib',
+        raw 'deflate' or 'gzip'.
+        """,
+    ).tag(config=True)
+
+    max_decompressed_size = Integer(
+        default_value=1024 * 1024,
+        help="""The maximum number of bytes that a payload is allowed to
+        decompress to, larger payloads are rejected.
+        """,
+    ).tag(config=True)
+
+    max_chunks = Integer(
+        default_value=64,
+        help="""The maximum number of numbered headers that a payload
+        is read from.
+        """,
+    ).tag(config=True)
+
+    chunk_header_format = Unicode(
+        default_value="{header}-{index}",
+        help="""The name of the numbered headers, where '{header}' is replaced
+        with the allowed_headers value and '{index}' with the chunk number,
+        starting at 1. The numbered headers are only read when the
+        header itself is missing.
+        """,
+    ).tag(config=True)
+
+    allow_uncompressed = Bool(
+        default_value=True,
+        help="""Whether plain JSON objects and arrays are accepted as well.
+        """,
+    ).tag(config=True)
+
+    def extract(self, data, header):
+        value = data.get(header, "")
+        if value:
+            return value
+        chunks = []
+        for index in range(1, self.max_chunks + 1):
+            chunk = data.get(
+                self.chunk_header_format.format(header=header, index=index), ""
+            )
+            if not chunk:
+                break
+            chunks.append(chunk)
+        return tuple(chunks)
+
+    def parse(self, data):
+        if not data:
+            self.log.error(
+                "CompressedJSONParser - Didn't receive any input missing data: %s",
+                data,
+            )
+            return None
+        chunks = (data,) if isinstance(data, JSONParser.json_types) else data
+        if (
+            self.allow_uncompressed
+            and len(chunks) == 1
+            and chunks[0][:1] in ("{", "[", b"{", b"[")
+        ):
+            return super().parse(chunks[0])
+        try:
+            payload = decompress_chunks(
+                chunks,
+                compression=self.compression,
+                max_size=self.max_decompressed_size,
+            )
+        except (DecompressionError, TypeError) as err:
+            self.log.error(
+                "CompressedJSONParser - Failed to decompress: %s chunks, %s",
+                len(chunks),
+                err,
+            )
+            return None
+        return self._loads(payload)
+
+
+class AsyncParser(Parser):
+    """
+    Base class for parsers that have to await I/O, e.g. a directory lookup.
+    The HeaderAuthenticator runs every AsyncParser of a request concurrently.
+    """
+
+    timeout = Float(
+        default_value=10.0,
+        help="""The number of seconds the parse is allowed to take before it is
+        abandoned and the header is treated as missing, 0 disables the timeout.
+        """,
+    ).tag(config=True)
+
+    @property
+    def http_client(self):
+        """The shared tornado AsyncHTTPClient of the event loop, so every parser
+        reuses the same client pool, which keeps connections alive when
+        JupyterHub has configured the curl client"""
+        return AsyncHTTPClient()
+
+    async def parse(self, data):
+        return data
+
+
+class HTTPLookupParser(AsyncParser):
+    """
+    Looks up the header value in a HTTP service, e.g. a local user mapping
+    service, and returns the decoded JSON response.
+    """
+
+    lookup_url = Unicode(
+        default_value="",
+        help="""The URL that is requested for each header value, where '{value}'
+        is replaced with the URL escaped header value.
+
+        E.g: http://127.0.0.1:8090/users/{value}
+        """,
+    ).tag(config=True)
+
+    lookup_headers = Dict(
+        default_value={},
+        help="""Dict of additional HTTP headers to send with each lookup request.
+        """,
+    ).tag(config=True)
+
+    async def parse(self, data):
+        if not data or not isinstance(data, str):
+            self.log.error(
+                "HTTPLookupParser - requires a str but data is of type: %s", type(data)
+            )
+            return None
+        url = self.lookup_url.format(value=url_escape(data, plus=False))
+        try:
+            response = await self.http_client.fetch(
+                url, headers=self.lookup_headers, request_timeout=self.timeout or None
+            )
+        except HTTPClientError as err:
+            if err.code == 404:
+                self.log.debug("HTTPLookupParser - %s was not found", url)
+            else:
+                self.log.error("HTTPLookupParser - lookup: %s failed: %s", url, err)
+            return None
+        except OSError as err:
+            self.log.error("HTTPLookupParser - lookup: %s failed: %s", url, err)
+            return None
+        try:
+            return json.loads(response.body)
+        except JSONDecodeError as err:
+            self.log.error(
+                "HTTPLookupParser - Failed to json decode the %s response: %s",
+                url,
+                err,
+            )
+            return None
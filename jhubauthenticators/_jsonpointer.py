@@ -0,0 +1,75 @@
+_missing = object()
+
+
+def parse_pointer(pointer):
+    """Split a JSON pointer (RFC 6901), e.g. '/claims/email', into a tuple
+    of unescaped reference tokens"""
+    if not pointer:
+        return ()
+    if not pointer.startswith("/"):
+        raise ValueError(
+            "Invalid JSON pointer: {}, it must start with a '/'".format(pointer)
+        )
+    return tuple(
+        token.replace("~1", "/").replace("~0", "~") for token in pointer[1:].split("/")
+    )
+
+
+def resolve_pointer(obj, tokens, default=None):
+    """Resolve the parsed pointer tokens in obj,
+    returns default if the pointer doesn't exist"""
+    for token in tokens:
+        if isinstance(obj, dict):
+            obj = obj.get(token, _missing)
+            if obj is _missing:
+                return default
+        elif isinstance(obj, list):
+            if not token.isdigit() or int(token) >= len(obj):
+                return default
+            obj = obj[int(token)]
+        else:
+            return default
+    return obj
+
+
+def compile_projection(pointers):
+    """Compile a list of JSON pointers, or plain top level keys, into a tree of
+    {reference token: subtree} dicts, where a subtree of None keeps the whole
+    value. Returns None when the list keeps the whole document"""
+    tree = {}
+    for pointer in pointers:
+        if pointer and not pointer.startswith("/"):
+            tokens = (pointer,)
+        else:
+            tokens = parse_pointer(pointer)
+        if not tokens:
+            return None
+        node = tree
+        for token in tokens[:-1]:
+            subtree = node.setdefault(token, {})
+            if subtree is None:
+                # A shorter pointer already keeps the whole value
+                break
+            node = subtree
+        else:
+            node[tokens[-1]] = None
+    return tree
+
+
+def project(obj, tree):
+    """Copy the parts of obj that are selected by a compiled projection tree,
+    the selected values are shared with obj. Objects that a pointer would
+    descend into by an array index or a scalar are kept whole"""
+    if not isinstance(obj, dict):
+        return obj
+    projected = {}
+    for token, subtree in tree.items():
+        value = obj.get(token, _missing)
+        if value is _missing:
+            continue
+        if subtree is not None:
+            value = project(value, subtree)
+            if value == {}:
+                continue
+        projected[token] = value
+    return projected
@@ -0,0 +1,324 @@
+"""
+Load generator that measures the /login and /set-user-data throughput and
+latency of a JupyterHub with a header authenticator configuration.
+
+A JupyterHub is started with the given configuration file, where the proxy
+and spawner are replaced by stubs, such that no Docker, configurable-http-proxy
+or notebook servers are required. Each record of the corpus, a JSON lines file,
+is either an object of headers, or an object with a 'headers' object and an
+optional 'user_data' object that is posted to /set-user-data after the login.
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from http.cookies import SimpleCookie
+from itertools import cycle
+from jupyterhub.proxy import Proxy
+from jupyterhub.spawner import Spawner
+from tornado.httpclient import AsyncHTTPClient, HTTPClientError
+from ._corpus import iter_lines, parse_record
+
+
+class StubProxy(Proxy):
+    """
+    Proxy that keeps the routes in memory without a proxy process,
+    the hub is reached directly on its hub_bind_url
+    """
+
+    should_start = False
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.routes = {}
+
+    async def add_route(self, routespec, target, data):
+        self.routes[routespec] = {
+            "routespec": routespec,
+            "target": target,
+            "data": data,
+        }
+
+    async def delete_route(self, routespec):
+        self.routes.pop(routespec, None)
+
+    async def get_all_routes(self):
+        return dict(self.routes)
+
+
+class StubSpawner(Spawner):
+    """Spawner that doesn't start a server process"""
+
+    _started = False
+
+    async def start(self):
+        self._started = True
+        return "http://127.0.0.1:{}".format(self.port or 8888)
+
+    async def poll(self):
+        return None if self._started else 0
+
+    async def stop(self, now=False):
+        self._started = False
+
+
+def percentile(sorted_values, percent):
+    """The nearest-rank percentile of the sorted values"""
+    if not sorted_values:
+        return None
+    rank = math.ceil(percent / 100 * len(sorted_values))
+    return sorted_values[min(max(rank, 1), len(sorted_values)) - 1]
+
+
+def load_corpus(path):
+    """Returns the list of (headers, user_data) records in the corpus"""
+    records = [parse_record(line) for _, line in iter_lines(path)]
+    if not records:
+        raise ValueError("The corpus: {} has no records".format(path))
+    return records
+
+
+def unused_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_hub(config, port, workdir):
+    """Start a JupyterHub with the config file, the stub proxy and spawner"""
+    command = [
+        sys.executable,
+        "-m",
+        "jupyterhub",
+        "--config={}".format(os.path.abspath(config)),
+        "--JupyterHub.proxy_class=jhubauthenticators._loadgen.StubProxy",
+        "--JupyterHub.spawner_class=jhubauthenticators._loadgen.StubSpawner",
+        "--JupyterHub.hub_bind_url=http://127.0.0.1:{}".format(port),
+        "--JupyterHub.db_url=sqlite:///{}".format(
+            os.path.join(workdir, "jupyterhub.sqlite")
+        ),
+        "--JupyterHub.cookie_secret_file={}".format(
+            os.path.join(workdir, "jupyterhub_cookie_secret")
+        ),
+        "--JupyterHub.pid_file={}".format(os.path.join(workdir, "jupyterhub.pid")),
+    ]
+    log = open(os.path.join(workdir, "jupyterhub.log"), "w")
+    return subprocess.Popen(command, cwd=workdir, stdout=log, stderr=log), log
+
+
+async def wait_for_hub(client, hub_url, process, log, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            with open(log.name, "r") as _file:
+                output = _file.read()
+            raise RuntimeError(
+                "JupyterHub exited with: {}, output:\n{}".format(
+                    process.returncode, output[-4096:]
+                )
+            )
+        try:
+            await client.fetch(hub_url + "/health", request_timeout=1)
+            return
+        except (HTTPClientError, OSError):
+            await asyncio.sleep(0.1)
+    raise RuntimeError("JupyterHub did not start within {} seconds".format(timeout))
+
+
+def response_cookies(response):
+    cookie = SimpleCookie()
+    for header in response.headers.get_list("Set-Cookie"):
+        cookie.load(header)
+    return {name: morsel.value for name, morsel in cookie.items()}
+
+
+class LoadGenerator:
+    """
+    Sends the corpus records as concurrent logins, each followed by a post
+    of its user_data, and records the latency and status of every request
+    """
+
+    def __init__(self, hub_url, records, concurrency, num_requests, timeout=30):
+        self.hub_url = hub_url
+        self.records = cycle(records)
+        self.concurrency = concurrency
+        self.remaining = num_requests
+        self.timeout = timeout
+        self.latencies = {"login": [], "set-user-data": []}
+        self.statuses = {"login": {}, "set-user-data": {}}
+        self.client = AsyncHTTPClient(force_instance=True, max_clients=concurrency)
+
+    async def fetch(self, endpoint, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = await self.client.fetch(
+                self.hub_url + "/" + endpoint,
+                follow_redirects=False,
+                raise_error=False,
+                request_timeout=self.timeout,
+                **kwargs
+            )
+            status = response.code
+        except OSError:
+            response, status = None, 599
+        self.latencies[endpoint].append(time.perf_counter() - start)
+        statuses = self.statuses[endpoint]
+        statuses[status] = statuses.get(status, 0) + 1
+        return response
+
+    async def worker(self):
+        while self.remaining > 0:
+            self.remaining -= 1
+            headers, user_data = next(self.records)
+            response = await self.fetch("login", headers=headers)
+            if user_data is None or response is None or response.code != 302:
+                continue
+            cookies = response_cookies(response)
+            post_headers = {
+                "Content-Type": "application/json",
+                "Cookie": "; ".join(
+                    "{}={}".format(name, value) for name, value in cookies.items()
+                ),
+            }
+            if "_xsrf" in cookies:
+                post_headers["X-XSRFToken"] = cookies["_xsrf"]
+            await self.fetch(
+                "set-user-data",
+                method="POST",
+                headers=post_headers,
+                body=json.dumps(user_data),
+            )
+
+    async def run(self):
+        start = time.perf_counter()
+        try:
+            await asyncio.gather(*[self.worker() for _ in range(self.concurrency)])
+        finally:
+            self.client.close()
+        return self.report(time.perf_counter() - start)
+
+    def report(self, elapsed):
+        report = {
+            "elapsed_seconds": elapsed,
+            "concurrency": self.concurrency,
+            "endpoints": {},
+        }
+        for endpoint, latencies in self.latencies.items():
+            if not latencies:
+                continue
+            latencies = sorted(latencies)
+            report["endpoints"][endpoint] = {
+                "requests": len(latencies),
+                "requests_per_second": len(latencies) / elapsed,
+                "statuses": {
+                    str(status): count
+                    for status, count in sorted(self.statuses[endpoint].items())
+                },
+                "latency_seconds": {
+                    "p50": percentile(latencies, 50),
+                    "p95": percentile(latencies, 95),
+                    "p99": percentile(latencies, 99),
+                    "max": latencies[-1],
+                },
+            }
+        return report
+
+
+def format_report(report):
+    lines = [
+        "elapsed: {:.2f}s, concurrency: {}".format(
+            report["elapsed_seconds"], report["concurrency"]
+        )
+    ]
+    for endpoint, result in report["endpoints"].items():
+        latency = result["latency_seconds"]
+        lines.append(
+            "{:<14} {:>7} requests {:>9.1f} req/s  p50 {:.1f}ms  p95 {:.1f}ms  "
+            "p99 {:.1f}ms  max {:.1f}ms  statuses {}".format(
+                endpoint,
+                result["requests"],
+                result["requests_per_second"],
+                latency["p50"] * 1000,
+                latency["p95"] * 1000,
+                latency["p99"] * 1000,
+                latency["max"] * 1000,
+                result["statuses"],
+            )
+        )
+    return "\n".join(lines)
+
+
+async def run(args, records):
+    process, log, hub_url = None, None, args.hub_url
+    workdir = tempfile.TemporaryDirectory(prefix="jhub-authenticators-loadgen-")
+    try:
+        if hub_url is None:
+            port = args.port or unused_port()
+            process, log = start_hub(args.config, port, workdir.name)
+            hub_url = "http://127.0.0.1:{}/hub".format(port)
+        client = AsyncHTTPClient(force_instance=True)
+        try:
+            await wait_for_hub(client, hub_url, process, log, args.start_timeout)
+        finally:
+            client.close()
+        generator = LoadGenerator(hub_url, records, args.concurrency, args.requests)
+        return await generator.run()
+    finally:
+        if process is not None:
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+            log.close()
+        workdir.cleanup()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Measure the /login and /set-user-data throughput and latency "
+        "of a JupyterHub with a header authenticator configuration"
+    )
+    parser.add_argument("config", help="The jupyterhub_config.py file to start with")
+    parser.add_argument("corpus", help="The JSON lines file of header sets")
+    parser.add_argument(
+        "--requests", type=int, default=1000, help="The number of logins to send"
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=10, help="The number of concurrent clients"
+    )
+    parser.add_argument(
+        "--port", type=int, default=0, help="The port of the started hub"
+    )
+    parser.add_argument(
+        "--hub-url",
+        default=None,
+        help="Send the load to an already running hub, e.g. http://127.0.0.1:8081/hub",
+    )
+    parser.add_argument(
+        "--start-timeout",
+        type=float,
+        default=60,
+        help="The number of seconds to wait for the hub to start",
+    )
+    parser.add_argument("--json", action="store_true", help="Output the JSON report")
+    args = parser.parse_args(argv)
+
+    records = load_corpus(args.corpus)
+    report = asyncio.run(run(args, records))
+    if args.json:
+        print(json.dumps(report, indent=4))
+    else:
+        print(format_report(report))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,49 @@
+import time
+from itertools import count
+
+
+class LogSampler:
+    """
+    Lets every n'th event through, used to turn a per-request log line
+    into sampled output
+    """
+
+    def __init__(self, interval=1):
+        if interval < 1:
+            interval = 1
+        self.interval = interval
+        self._counter = count()
+
+    def sample(self):
+        """Returns the number of events that has happened since
+        the previous sample if this event should be logged, otherwise None"""
+        num = next(self._counter)
+        if num % self.interval == 0:
+            return min(num, self.interval) or 1
+        return None
+
+
+class LogRateLimiter:
+    """
+    Lets at most one event through every interval seconds,
+    and counts the events that were suppressed in between
+    """
+
+    def __init__(self, interval=60.0, timer=time.monotonic):
+        self.interval = interval
+        self.suppressed = 0
+        self.total_suppressed = 0
+        self._timer = timer
+        self._next = 0.0
+
+    def acquire(self):
+        """Returns the number of events that were suppressed since the
+        previous event if this event should be logged, otherwise None"""
+        now = self._timer()
+        if now < self._next:
+            self.suppressed += 1
+            self.total_suppressed += 1
+            return None
+        self._next = now + self.interval
+        suppressed, self.suppressed = self.suppressed, 0
+        return suppressed
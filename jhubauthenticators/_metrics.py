@@ -0,0 +1,87 @@
+"""
+Prometheus metrics of the authenticators, registered in the default
+prometheus registry that JupyterHub serves on /hub/metrics.
+The metric names are prefixed with the JupyterHub metrics prefix.
+"""
+
+from enum import Enum
+from prometheus_client import Counter, Histogram
+from jupyterhub.metrics import metrics_prefix
+
+AUTHENTICATE_DURATION_SECONDS = Histogram(
+    "header_authenticate_duration_seconds",
+    "Time taken by HeaderAuthenticator.authenticate",
+    ["status"],
+    buckets=[0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1, 5],
+    namespace=metrics_prefix,
+)
+
+HEADER_PARSE_DURATION_SECONDS = Histogram(
+    "header_parse_duration_seconds",
+    "Time taken to parse an allowed_headers value",
+    ["header_key"],
+    buckets=[0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.005, 0.01, 0.1, 1, 5],
+    namespace=metrics_prefix,
+)
+
+LOGIN_FAILURES = Counter(
+    "header_login_failures",
+    "Number of /login requests that were answered with 401",
+    ["reason"],
+    namespace=metrics_prefix,
+)
+
+PRE_SPAWN_START_DURATION_SECONDS = Histogram(
+    "header_pre_spawn_start_duration_seconds",
+    "Time taken by HeaderAuthenticator.pre_spawn_start",
+    buckets=[0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1, 5],
+    namespace=metrics_prefix,
+)
+
+USER_DATA_SIZE_BYTES = Histogram(
+    "header_user_data_size_bytes",
+    "Size of the JSON payloads posted to /set-user-data",
+    buckets=[64, 256, 1024, 4096, 16384, 65536, 262144, 1048576],
+    namespace=metrics_prefix,
+)
+
+
+class AuthenticateStatus(Enum):
+    """Possible values for 'status' label of AUTHENTICATE_DURATION_SECONDS"""
+
+    success = "success"
+    failure = "failure"
+
+    def __str__(self):
+        return self.value
+
+
+for s in AuthenticateStatus:
+    AUTHENTICATE_DURATION_SECONDS.labels(status=s)
+
+# Resolving a labelled child takes longer than observing it,
+# so the per-login children are resolved once
+AUTHENTICATE_SUCCESS_DURATION_SECONDS = AUTHENTICATE_DURATION_SECONDS.labels(
+    status=AuthenticateStatus.success
+)
+AUTHENTICATE_FAILURE_DURATION_SECONDS = AUTHENTICATE_DURATION_SECONDS.labels(
+    status=AuthenticateStatus.failure
+)
+
+
+class LoginFailureReason(Enum):
+    """Possible values for 'reason' label of LOGIN_FAILURES"""
+
+    # The request had no 'auth' header
+    missing_header = "missing_header"
+    # The parsed 'auth' header value was empty
+    missing_username = "missing_username"
+    # The user was not allowed
+    not_allowed = "not_allowed"
+
+    def __str__(self):
+        return self.value
+
+
+for r in LoginFailureReason:
+    LOGIN_FAILURES.labels(reason=r)
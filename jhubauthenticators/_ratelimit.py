@@ -0,0 +1,38 @@
+import time
+from ._cache import LRUCache
+
+
+class TokenBucketLimiter:
+    """
+    Per key token buckets that are refilled with rate tokens per second up to
+    burst tokens. A bucket that has been idle for burst / rate seconds is full
+    again, so the buckets expire from the bounded LRU store after that time
+    and a new bucket is started full.
+    """
+
+    def __init__(self, rate, burst, max_keys=10000, timer=time.monotonic):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.limited = 0
+        self._timer = timer
+        self._buckets = LRUCache(max_size=max_keys, ttl=self.burst / rate, timer=timer)
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def acquire(self, key=None):
+        """Take a token from the key's bucket, returns 0 if a token was taken,
+        otherwise the number of seconds until the next token is available"""
+        now = self._timer()
+        bucket = self._buckets.get(key, count=False)
+        if bucket is None:
+            tokens = self.burst
+        else:
+            tokens, updated = bucket
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        if tokens >= 1:
+            self._buckets.set(key, (tokens - 1, now))
+            return 0
+        self._buckets.set(key, (tokens, now))
+        self.limited += 1
+        return (1 - tokens) / self.rate
@@ -0,0 +1,34 @@
+import asyncio
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key, such that only the first
+    caller runs the call while the others await its result
+    """
+
+    def __init__(self):
+        self._inflight = {}
+
+    def __len__(self):
+        return len(self._inflight)
+
+    def __contains__(self, key):
+        return key in self._inflight
+
+    async def run(self, key, func, *args, **kwargs):
+        future = self._inflight.get(key, None)
+        if future is None:
+            future = asyncio.ensure_future(func(*args, **kwargs))
+            self._inflight[key] = future
+            future.add_done_callback(lambda done: self._done(key, done))
+        # A cancelled caller must not cancel the shared call
+        return await asyncio.shield(future)
+
+    def forget(self, key):
+        """Let the next caller start a new call, even if one is still in-flight"""
+        self._inflight.pop(key, None)
+
+    def _done(self, key, future):
+        if self._inflight.get(key, None) is future:
+            del self._inflight[key]
@@ -0,0 +1,28 @@
+class ServerTiming:
+    """
+    Records the durations in seconds of the named stages of a request,
+    which are rendered as a Server-Timing header value
+    """
+
+    def __init__(self):
+        self.stages = []
+
+    def add(self, name, duration):
+        self.stages.append((name, duration))
+
+    def observer(self, name, observe=None):
+        """Returns a callable that records the duration it is called with
+        as the name stage, and passes it on to observe"""
+
+        def record(duration):
+            self.stages.append((name, duration))
+            if observe is not None:
+                observe(duration)
+
+        return record
+
+    def header_value(self):
+        return ", ".join(
+            "{};dur={:.3f}".format(name, duration * 1000)
+            for name, duration in self.stages
+        )
@@ -38,6 +38,12 @@ setup(
         "test": read_req("tests/requirements.txt"),
         "dev": read_req("requirements-dev.txt"),
     },
+    entry_points={
+        "console_scripts": [
+            "jhub-authenticators-check = jhubauthenticators._check:main",
+            "jhub-authenticators-loadgen = jhubauthenticators._loadgen:main",
+        ]
+    },
     project_urls={"Source Code": "https://github.com/ucphhpc/jhub-authenticators"},
     classifiers=[
         "Intended Audience :: Developers",
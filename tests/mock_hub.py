@@ -0,0 +1,193 @@
+import asyncio
+import logging
+import uuid
+from types import SimpleNamespace
+from tornado import web
+from tornado.httpclient import AsyncHTTPClient
+from tornado.httpserver import HTTPServer
+from tornado.testing import bind_unused_port
+from traitlets.config import Config
+from jupyterhub.handlers import BaseHandler
+from jupyterhub.handlers.base import SESSION_COOKIE_NAME
+from jupyterhub.utils import url_path_join
+from jhubauthenticators import HeaderAuthenticator
+
+MOCK_COOKIE_NAME = "mock-hub-user"
+
+
+def new_authenticator(**traits):
+    """A HeaderAuthenticator configured with the given traits"""
+    config = Config()
+    for trait_key, trait_val in traits.items():
+        setattr(config.HeaderAuthenticator, trait_key, trait_val)
+    return HeaderAuthenticator(config=config)
+
+
+class MockDB:
+    dirty = ()
+
+    def __init__(self):
+        self.commits = 0
+
+    def commit(self):
+        self.commits += 1
+
+
+class MockUser:
+    def __init__(self, name, db):
+        self.name = name
+        self.db = db
+        self.encrypted_auth_state = None
+        self.auth_state = None
+        self.last_activity = None
+        self.saved = 0
+
+    async def save_auth_state(self, auth_state):
+        self.saved += 1
+        self.auth_state = auth_state
+        self.encrypted_auth_state = None if auth_state is None else repr(auth_state)
+        self.db.commit()
+
+    async def get_auth_state(self):
+        return self.auth_state
+
+
+class MockHub:
+    """
+    Stands in for the JupyterHub application and ORM when running the
+    authenticator handlers in-process. The BaseHandler methods that require
+    the database are replaced by monkeypatching.
+    """
+
+    def __init__(self, authenticator, login_delay=0, login_barrier=0):
+        self.authenticator = authenticator
+        self.login_delay = login_delay
+        # Hold every login until this number of requests have been prepared
+        self.login_barrier = login_barrier
+        self.prepared = 0
+        self.db = MockDB()
+        self.users = {}
+        self.login_calls = 0
+        self.auth_to_user_calls = 0
+        self.settings = {
+            "authenticator": authenticator,
+            "db": self.db,
+            "users": self.users,
+            "hub": SimpleNamespace(
+                base_url="/hub/", server=SimpleNamespace(base_url="/hub/")
+            ),
+            "log": logging.getLogger("mock_hub"),
+            "login_url": "/hub/login",
+        }
+
+    def patch(self, monkeypatch):
+        mock_hub = self
+
+        async def prepare(self):
+            mock_hub.prepared += 1
+            self._jupyterhub_user = self.get_current_user_cookie()
+
+        def get_current_user_cookie(self):
+            name = self.get_cookie(MOCK_COOKIE_NAME, None)
+            return mock_hub.users.get(name, None) if name else None
+
+        async def login_user(self, data=None):
+            mock_hub.login_calls += 1
+            while mock_hub.prepared < mock_hub.login_barrier:
+                await asyncio.sleep(0.01)
+            if mock_hub.login_delay:
+                await asyncio.sleep(mock_hub.login_delay)
+            authenticated = await self.authenticator.get_authenticated_user(self, data)
+            if authenticated:
+                user = await self.auth_to_user(authenticated)
+                self.set_login_cookie(user)
+                return user
+
+        async def auth_to_user(self, authenticated, user=None):
+            mock_hub.auth_to_user_calls += 1
+            return await mock_auth_to_user(self, authenticated, user=user)
+
+        def set_login_cookie(self, user):
+            self.set_cookie(MOCK_COOKIE_NAME, user.name)
+            self._jupyterhub_user = user
+
+        def find_user(self, name):
+            return mock_hub.users.get(name, None)
+
+        def set_session_cookie(self):
+            if not hasattr(self, "_session_id"):
+                self._session_id = uuid.uuid4().hex
+            self.set_cookie(SESSION_COOKIE_NAME, self._session_id)
+            return self._session_id
+
+        monkeypatch.setattr(BaseHandler, "prepare", prepare)
+        monkeypatch.setattr(
+            BaseHandler, "get_current_user_cookie", get_current_user_cookie
+        )
+        monkeypatch.setattr(BaseHandler, "login_user", login_user)
+        monkeypatch.setattr(BaseHandler, "auth_to_user", auth_to_user)
+        monkeypatch.setattr(BaseHandler, "set_login_cookie", set_login_cookie)
+        monkeypatch.setattr(BaseHandler, "find_user", find_user)
+        monkeypatch.setattr(BaseHandler, "set_session_cookie", set_session_cookie)
+        monkeypatch.setattr(BaseHandler, "write_error", web.RequestHandler.write_error)
+
+    def application(self, extra_handlers=None):
+        handlers = [
+            (url_path_join("/hub", path), handler)
+            for path, handler in self.authenticator.get_handlers(None)
+            + list(extra_handlers or [])
+        ]
+        return web.Application(handlers, **self.settings)
+
+    def handler(self, handler_class):
+        """Create a handler instance without a request"""
+        handler = handler_class.__new__(handler_class)
+        handler.application = SimpleNamespace(settings=self.settings)
+        return handler
+
+
+class WhoAmIHandler(BaseHandler):
+    """An authenticated hub page that writes the name of the current user"""
+
+    @web.authenticated
+    def get(self):
+        self.write(self.current_user.name)
+
+
+async def mock_auth_to_user(self, authenticated, user=None):
+    """Stand-in for BaseHandler.auth_to_user that ends with save_auth_state"""
+    if user is None:
+        user = self.find_user(authenticated["name"])
+        if user is None:
+            user = self.users[authenticated["name"]] = MockUser(
+                authenticated["name"], self.db
+            )
+    await user.save_auth_state(authenticated.get("auth_state", None))
+    return user
+
+
+class MockHubServer:
+    """Serves the MockHub application on a local port"""
+
+    def __init__(self, mock_hub, extra_handlers=None):
+        self.mock_hub = mock_hub
+        self.extra_handlers = extra_handlers
+        self.server = None
+        self.url = None
+
+    async def __aenter__(self):
+        sock, port = bind_unused_port()
+        self.server = HTTPServer(self.mock_hub.application(self.extra_handlers))
+        self.server.add_sockets([sock])
+        self.url = "http://127.0.0.1:{}/hub".format(port)
+        return self
+
+    async def __aexit__(self, *args):
+        self.server.stop()
+
+    async def fetch(self, path, client=None, **kwargs):
+        if client is None:
+            client = AsyncHTTPClient()
+        kwargs.setdefault("follow_redirects", False)
+        kwargs.setdefault("raise_error", False)
+        return await client.fetch(self.url + path, **kwargs)
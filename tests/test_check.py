@@ -0,0 +1,116 @@
+import json
+from jhubauthenticators._check import main
+
+CONFIG = """
+from jhubauthenticators import JSONParser, RegexUsernameParser
+
+c = get_config()
+
+c.JupyterHub.authenticator_class = "jhubauthenticators.HeaderAuthenticator"
+c.Authenticator.allowed_users = {"user_example_org"}
+c.HeaderAuthenticator.allowed_headers = {"auth": "Remote-User", "jsondata": "JsonData"}
+c.HeaderAuthenticator.header_parser_classes = {
+    "auth": RegexUsernameParser,
+    "jsondata": JSONParser,
+}
+c.RegexUsernameParser.username_extract_regex = (
+    "([a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\\\\.[a-zA-Z0-9-.]+)"
+)
+c.RegexUsernameParser.replace_extract_chars = {"@": "_", ".": "_"}
+"""
+
+
+def write_files(tmp_path, records):
+    config = tmp_path / "jupyterhub_config.py"
+    config.write_text(CONFIG)
+    corpus = tmp_path / "corpus.jsonl"
+    corpus.write_text("\n".join(records) + "\n")
+    return str(config), str(corpus)
+
+
+def test_check_corpus(tmp_path, capsys):
+    config, corpus = write_files(
+        tmp_path,
+        [
+            json.dumps(
+                {"Remote-User": "user@example.org", "JsonData": '{"groups": []}'}
+            ),
+            json.dumps({"headers": {"remote-user": "other@example.org"}}),
+            "",
+            json.dumps({"Remote-User": "not-an-email"}),
+            json.dumps({"JsonData": "{}"}),
+            "not json",
+        ],
+    )
+    assert main([config, corpus]) == 1
+    out, err = capsys.readouterr()
+    results = [json.loads(line) for line in out.splitlines()]
+    assert [result["line"] for result in results] == [1, 2, 4, 5, 6]
+    assert results[0] == {
+        "line": 1,
+        "ok": True,
+        "name": "user_example_org",
+        "auth_state_keys": ["JsonData"],
+    }
+    # The header names are case insensitive like in the request
+    assert results[1]["name"] == "other_example_org"
+    assert [result["ok"] for result in results[2:]] == [False, False, False]
+    assert results[2]["reason"].startswith("HTTP 401")
+    assert results[4]["reason"].startswith("JSONDecodeError")
+
+    summary = json.loads(err)
+    assert summary["records"] == 5
+    assert summary["failed"] == 3
+    assert summary["failure_reasons"][results[2]["reason"]] == 2
+
+
+def test_check_corpus_allowed(tmp_path, capsys):
+    config, corpus = write_files(
+        tmp_path,
+        [
+            json.dumps({"Remote-User": "user@example.org"}),
+            json.dumps({"Remote-User": "other@example.org"}),
+        ],
+    )
+    assert main([config, corpus, "--check-allowed", "--failures-only"]) == 1
+    out, _ = capsys.readouterr()
+    results = [json.loads(line) for line in out.splitlines()]
+    assert results == [
+        {
+            "line": 2,
+            "ok": False,
+            "reason": "ValueError: user: other_example_org is not allowed",
+        }
+    ]
+
+    config, corpus = write_files(
+        tmp_path, [json.dumps({"Remote-User": "user@example.org"})]
+    )
+    assert main([config, corpus, "--check-allowed", "--quiet"]) == 0
+    out, _ = capsys.readouterr()
+    assert out == ""
+
+
+def test_check_corpus_keeps_order(tmp_path, capsys):
+    config, corpus = write_files(
+        tmp_path,
+        [
+            "[]",
+            json.dumps({"Remote-User": "user@example.org"}),
+            "not json",
+            "not json",
+            json.dumps({"Remote-User": "user@example.org"}),
+            "not json",
+        ],
+    )
+    assert main([config, corpus, "--batch-size", "1"]) == 1
+    out, _ = capsys.readouterr()
+    results = [json.loads(line) for line in out.splitlines()]
+    assert [(result["line"], result["ok"]) for result in results] == [
+        (1, False),
+        (2, True),
+        (3, False),
+        (4, False),
+        (5, True),
+        (6, False),
+    ]
@@ -0,0 +1,481 @@
+import asyncio
+import json
+import logging
+from prometheus_client import REGISTRY
+from jupyterhub.handlers.base import SESSION_COOKIE_NAME
+from tornado.httpclient import AsyncHTTPClient
+from jhubauthenticators import (
+    AsyncParser,
+    HeaderLoginHandler,
+    JSONParser,
+    Parser,
+)
+from jhubauthenticators._jhub_shared import MISSING_HEADER_BODY
+from mock_hub import (
+    MOCK_COOKIE_NAME,
+    MockHub,
+    MockHubServer,
+    MockUser,
+    WhoAmIHandler,
+    new_authenticator,
+)
+
+
+def test_skip_unchanged_auth_state(monkeypatch):
+    """
+    Test that an unchanged auth_state is only encrypted and stored once
+    """
+    mock_hub = MockHub(
+        new_authenticator(enable_auth_state=True, skip_unchanged_auth_state=True)
+    )
+    mock_hub.patch(monkeypatch)
+    authenticated = {"name": "user", "auth_state": {"Data": {"a": 1, "b": 2}}}
+    for _ in range(3):
+        handler = mock_hub.handler(HeaderLoginHandler)
+        user = asyncio.run(handler.auth_to_user(dict(authenticated)))
+    assert user.saved == 1
+    # The other user changes are still committed
+    assert mock_hub.db.commits == 3
+
+    # The key order doesn't matter
+    handler = mock_hub.handler(HeaderLoginHandler)
+    asyncio.run(
+        handler.auth_to_user({"name": "user", "auth_state": {"Data": {"b": 2, "a": 1}}})
+    )
+    assert user.saved == 1
+
+    handler = mock_hub.handler(HeaderLoginHandler)
+    asyncio.run(handler.auth_to_user({"name": "user", "auth_state": {"Data": "new"}}))
+    assert user.saved == 2
+    assert user.auth_state == {"Data": "new"}
+
+
+def test_skip_unchanged_auth_state_disabled(monkeypatch):
+    mock_hub = MockHub(new_authenticator(enable_auth_state=True))
+    mock_hub.patch(monkeypatch)
+    for _ in range(3):
+        handler = mock_hub.handler(HeaderLoginHandler)
+        user = asyncio.run(
+            handler.auth_to_user({"name": "user", "auth_state": {"Data": "x"}})
+        )
+    assert user.saved == 3
+
+
+def test_skip_unchanged_auth_state_stores_cleared_state(monkeypatch):
+    """
+    Test that the auth_state is stored again if the stored state was
+    cleared since the digest was recorded
+    """
+    mock_hub = MockHub(
+        new_authenticator(enable_auth_state=True, skip_unchanged_auth_state=True)
+    )
+    mock_hub.patch(monkeypatch)
+    authenticated = {"name": "user", "auth_state": {"Data": "x"}}
+    handler = mock_hub.handler(HeaderLoginHandler)
+    user = asyncio.run(handler.auth_to_user(dict(authenticated)))
+    user.encrypted_auth_state = None
+    handler = mock_hub.handler(HeaderLoginHandler)
+    asyncio.run(handler.auth_to_user(dict(authenticated)))
+    assert user.saved == 2
+
+
+async def concurrent_logins(mock_hub, usernames, num_requests):
+    client = AsyncHTTPClient(force_instance=True, max_clients=num_requests)
+    try:
+        async with MockHubServer(mock_hub) as server:
+            return await asyncio.gather(
+                *[
+                    server.fetch(
+                        "/login",
+                        client=client,
+                        headers={"Remote-User": usernames[index % len(usernames)]},
+                    )
+                    for index in range(num_requests)
+                ]
+            )
+    finally:
+        client.close()
+
+
+def test_coalesce_concurrent_logins(monkeypatch):
+    """
+    Test that hundreds of simultaneous logins for the same identities
+    share a single login per identity, while every request gets its cookie
+    """
+    mock_hub = MockHub(
+        new_authenticator(allow_all=True, coalesce_concurrent_logins=True),
+        login_barrier=300,
+    )
+    mock_hub.patch(monkeypatch)
+    usernames = ["user-0", "user-1", "user-2"]
+    responses = asyncio.run(concurrent_logins(mock_hub, usernames, 300))
+    assert all(response.code == 302 for response in responses)
+    for index, response in enumerate(responses):
+        assert (
+            "{}={}".format(MOCK_COOKIE_NAME, usernames[index % len(usernames)])
+            in response.headers["Set-Cookie"]
+        )
+    assert mock_hub.login_calls == len(usernames)
+    assert mock_hub.auth_to_user_calls == len(usernames)
+    assert len(mock_hub.authenticator.login_flight) == 0
+
+
+def test_concurrent_logins_without_coalescing(monkeypatch):
+    mock_hub = MockHub(new_authenticator(allow_all=True), login_barrier=20)
+    mock_hub.patch(monkeypatch)
+    responses = asyncio.run(concurrent_logins(mock_hub, ["user"], 20))
+    assert all(response.code == 302 for response in responses)
+    assert mock_hub.login_calls == 20
+
+
+def test_coalesce_concurrent_failed_logins(monkeypatch):
+    mock_hub = MockHub(
+        new_authenticator(allowed_users={"user"}, coalesce_concurrent_logins=True),
+        login_barrier=50,
+    )
+    mock_hub.patch(monkeypatch)
+    responses = asyncio.run(concurrent_logins(mock_hub, ["not-allowed"], 50))
+    assert all(response.code == 401 for response in responses)
+    assert mock_hub.login_calls == 1
+
+
+async def fetch_whoami(mock_hub, requests):
+    async with MockHubServer(mock_hub, [(r"/whoami", WhoAmIHandler)]) as server:
+        return [await server.fetch("/whoami", headers=headers) for headers in requests]
+
+
+def test_header_bound_sessions(monkeypatch):
+    """
+    Test that an existing user is resolved from the auth header on every
+    request without a login redirect or cookie
+    """
+    mock_hub = MockHub(new_authenticator(allow_all=True, header_bound_sessions=True))
+    mock_hub.patch(monkeypatch)
+    asyncio.run(concurrent_logins(mock_hub, ["user"], 1))
+    responses = asyncio.run(
+        fetch_whoami(
+            mock_hub,
+            [
+                {"Remote-User": "user"},
+                {"Remote-User": "user"},
+                {"Remote-User": "unknown"},
+                {},
+            ],
+        )
+    )
+    assert [response.code for response in responses] == [200, 200, 302, 302]
+    assert responses[0].body == b"user"
+    # Only the session id cookie is set, as for a login cookie
+    assert responses[0].headers["Set-Cookie"].startswith(SESSION_COOKIE_NAME + "=")
+    # Unknown users and requests without the header must login
+    assert responses[2].headers["Location"].startswith("/hub/login")
+    assert mock_hub.login_calls == 1
+    assert mock_hub.authenticator._header_user_cache.info()["hits"] == 1
+    assert mock_hub.users["user"].last_activity is not None
+
+
+def test_header_bound_sessions_existing_session_cookie(monkeypatch):
+    mock_hub = MockHub(new_authenticator(allow_all=True, header_bound_sessions=True))
+    mock_hub.patch(monkeypatch)
+    asyncio.run(concurrent_logins(mock_hub, ["user"], 1))
+    responses = asyncio.run(
+        fetch_whoami(
+            mock_hub,
+            [{"Remote-User": "user", "Cookie": SESSION_COOKIE_NAME + "=session-id"}],
+        )
+    )
+    assert responses[0].body == b"user"
+    assert "Set-Cookie" not in responses[0].headers
+
+
+def test_header_bound_sessions_header_decides(monkeypatch):
+    mock_hub = MockHub(new_authenticator(allow_all=True, header_bound_sessions=True))
+    mock_hub.patch(monkeypatch)
+    asyncio.run(concurrent_logins(mock_hub, ["user-0", "user-1"], 2))
+    responses = asyncio.run(
+        fetch_whoami(
+            mock_hub,
+            [
+                {"Remote-User": "user-1", "Cookie": MOCK_COOKIE_NAME + "=user-0"},
+                {"Cookie": MOCK_COOKIE_NAME + "=user-0"},
+            ],
+        )
+    )
+    assert [response.body for response in responses] == [b"user-1", b"user-0"]
+
+
+def test_header_bound_sessions_async_auth_parser(monkeypatch):
+    """
+    Test that the login cookie is used when the 'auth' header parser
+    is asynchronous, instead of redirecting to /login on every request
+    """
+    mock_hub = MockHub(
+        new_authenticator(
+            allow_all=True,
+            header_bound_sessions=True,
+            header_parser_classes={"auth": AsyncParser},
+        )
+    )
+    mock_hub.patch(monkeypatch)
+    asyncio.run(concurrent_logins(mock_hub, ["user"], 1))
+    responses = asyncio.run(
+        fetch_whoami(
+            mock_hub,
+            [
+                {"Remote-User": "user", "Cookie": MOCK_COOKIE_NAME + "=user"},
+                {"Remote-User": "user"},
+            ],
+        )
+    )
+    assert [response.code for response in responses] == [200, 302]
+    assert responses[0].body == b"user"
+
+
+def test_header_bound_sessions_checks_users(monkeypatch):
+    """
+    Test that blocked and no longer allowed users aren't resolved from the
+    'auth' header, and that they are sent to /login instead
+    """
+    mock_hub = MockHub(
+        new_authenticator(
+            header_bound_sessions=True, allowed_users={"user-0", "user-1"}
+        )
+    )
+    mock_hub.patch(monkeypatch)
+    authenticator = mock_hub.authenticator
+    asyncio.run(concurrent_logins(mock_hub, ["user-0", "user-1"], 2))
+    authenticator.blocked_users = {"user-0"}
+    authenticator.allowed_users = {"user-0"}
+    responses = asyncio.run(
+        fetch_whoami(mock_hub, [{"Remote-User": "user-0"}, {"Remote-User": "user-1"}])
+    )
+    assert [response.code for response in responses] == [302, 302]
+    assert len(authenticator._header_user_cache) == 0
+
+
+def test_header_bound_sessions_disabled(monkeypatch):
+    mock_hub = MockHub(new_authenticator(allow_all=True))
+    mock_hub.patch(monkeypatch)
+    asyncio.run(concurrent_logins(mock_hub, ["user"], 1))
+    responses = asyncio.run(fetch_whoami(mock_hub, [{"Remote-User": "user"}]))
+    assert responses[0].code == 302
+
+
+async def fetch_logins(mock_hub, requests):
+    async with MockHubServer(mock_hub) as server:
+        return [await server.fetch("/login", headers=headers) for headers in requests]
+
+
+def test_reject_missing_auth_header(monkeypatch, caplog):
+    """
+    Test that logins without the auth header are rejected before login_user
+    with a pre-rendered body, and that the error log is rate limited
+    """
+    mock_hub = MockHub(
+        new_authenticator(allow_all=True, reject_missing_auth_header=True)
+    )
+    mock_hub.patch(monkeypatch)
+    with caplog.at_level(logging.ERROR):
+        responses = asyncio.run(
+            fetch_logins(mock_hub, [{}] * 20 + [{"Remote-User": ""}])
+        )
+    assert all(response.code == 401 for response in responses)
+    assert all(response.body == MISSING_HEADER_BODY for response in responses)
+    assert mock_hub.login_calls == 0
+
+    authenticator = mock_hub.authenticator
+    assert authenticator.missing_header_rejections == 21
+    assert authenticator.missing_header_log_limiter.total_suppressed == 20
+    assert len([r for r in caplog.records if "rejected a login" in r.message]) == 1
+
+    # Requests with the header are still logged in
+    responses = asyncio.run(fetch_logins(mock_hub, [{"Remote-User": "user"}]))
+    assert responses[0].code == 302
+    assert mock_hub.login_calls == 1
+
+
+def test_missing_auth_header_without_fast_path(monkeypatch):
+    mock_hub = MockHub(new_authenticator(allow_all=True))
+    mock_hub.patch(monkeypatch)
+    responses = asyncio.run(fetch_logins(mock_hub, [{}]))
+    assert responses[0].code == 401
+    assert responses[0].body != MISSING_HEADER_BODY
+    assert mock_hub.login_calls == 1
+
+
+def test_login_rate_limit(monkeypatch):
+    mock_hub = MockHub(
+        new_authenticator(allow_all=True, login_rate_limit=0.5, login_rate_burst=2)
+    )
+    mock_hub.patch(monkeypatch)
+    responses = asyncio.run(
+        fetch_logins(
+            mock_hub, [{"Remote-User": "user"}] * 4 + [{"Remote-User": "other"}]
+        )
+    )
+    assert [response.code for response in responses] == [302, 302, 429, 429, 302]
+    assert responses[2].headers["Retry-After"] == "2"
+    assert mock_hub.login_calls == 3
+
+
+def test_global_login_rate_limit(monkeypatch):
+    mock_hub = MockHub(
+        new_authenticator(
+            allow_all=True, global_login_rate_limit=1.0, global_login_rate_burst=2
+        )
+    )
+    mock_hub.patch(monkeypatch)
+    responses = asyncio.run(
+        fetch_logins(mock_hub, [{"Remote-User": str(index)} for index in range(3)])
+    )
+    assert [response.code for response in responses] == [302, 302, 429]
+    assert responses[2].headers["Retry-After"] == "1"
+
+
+def sample_value(name, **labels):
+    return REGISTRY.get_sample_value("jupyterhub_" + name, labels) or 0
+
+
+def test_login_metrics(monkeypatch):
+    """
+    Test that the authenticate latency, parse time and 401 reasons
+    are registered in the default prometheus registry
+    """
+    mock_hub = MockHub(
+        new_authenticator(
+            allowed_users={"user"},
+            reject_missing_auth_header=True,
+            allowed_headers={"auth": "Remote-User", "jsondata": "JsonData"},
+            header_parser_classes={"auth": Parser, "jsondata": JSONParser},
+        )
+    )
+    mock_hub.patch(monkeypatch)
+    before = {
+        "success": sample_value(
+            "header_authenticate_duration_seconds_count", status="success"
+        ),
+        "parse": sample_value(
+            "header_parse_duration_seconds_count", header_key="jsondata"
+        ),
+        "missing_header": sample_value(
+            "header_login_failures_total", reason="missing_header"
+        ),
+        "not_allowed": sample_value(
+            "header_login_failures_total", reason="not_allowed"
+        ),
+    }
+    responses = asyncio.run(
+        fetch_logins(
+            mock_hub,
+            [
+                {"Remote-User": "user", "JsonData": "{}"},
+                {"Remote-User": "x", "JsonData": "[]"},
+                {},
+            ],
+        )
+    )
+    assert [response.code for response in responses] == [302, 401, 401]
+    after = {
+        "success": sample_value(
+            "header_authenticate_duration_seconds_count", status="success"
+        ),
+        "parse": sample_value(
+            "header_parse_duration_seconds_count", header_key="jsondata"
+        ),
+        "missing_header": sample_value(
+            "header_login_failures_total", reason="missing_header"
+        ),
+        "not_allowed": sample_value(
+            "header_login_failures_total", reason="not_allowed"
+        ),
+    }
+    assert after["success"] - before["success"] == 2
+    assert after["parse"] - before["parse"] == 2
+    assert after["missing_header"] - before["missing_header"] == 1
+    assert after["not_allowed"] - before["not_allowed"] == 1
+
+
+def test_login_server_timing(monkeypatch, caplog):
+    mock_hub = MockHub(
+        new_authenticator(
+            allow_all=True,
+            login_server_timing=True,
+            login_timing_log=True,
+            allowed_headers={"auth": "Remote-User", "jsondata": "JsonData"},
+            header_parser_classes={"auth": Parser, "jsondata": JSONParser},
+        )
+    )
+    mock_hub.patch(monkeypatch)
+    with caplog.at_level(logging.DEBUG):
+        responses = asyncio.run(
+            fetch_logins(mock_hub, [{"Remote-User": "user", "JsonData": "{}"}])
+        )
+    assert responses[0].code == 302
+    stages = [
+        stage.split(";dur=")[0]
+        for stage in responses[0].headers["Server-Timing"].split(", ")
+    ]
+    assert stages == [
+        "parse-Remote-User",
+        "parse-JsonData",
+        "authenticate",
+        "login",
+    ]
+    assert any("stage timings" in record.message for record in caplog.records)
+
+
+def test_login_server_timing_disabled(monkeypatch):
+    mock_hub = MockHub(new_authenticator(allow_all=True))
+    mock_hub.patch(monkeypatch)
+    responses = asyncio.run(fetch_logins(mock_hub, [{"Remote-User": "user"}]))
+    assert responses[0].code == 302
+    assert "Server-Timing" not in responses[0].headers
+
+
+def test_reload_header_config_endpoint(monkeypatch, tmp_path):
+    """
+    Test that only admins can reload the header config, and that
+    a failed reload is reported and keeps the previous config
+    """
+    config_file = tmp_path / "jupyterhub_config.py"
+    config_file.write_text(
+        'c.HeaderAuthenticator.allowed_headers = {"auth": "X-Remote-User"}\n'
+    )
+    mock_hub = MockHub(
+        new_authenticator(
+            allow_all=True,
+            header_config_reload=True,
+            header_config_file=str(config_file),
+        )
+    )
+    mock_hub.patch(monkeypatch)
+    for name, admin in (("admin", True), ("user", False)):
+        mock_hub.users[name] = MockUser(name, mock_hub.db)
+        mock_hub.users[name].admin = admin
+
+    async def reload(name):
+        async with MockHubServer(mock_hub) as server:
+            return await server.fetch(
+                "/reload-header-config",
+                method="POST",
+                body=b"",
+                headers={"Cookie": "{}={}".format(MOCK_COOKIE_NAME, name)},
+            )
+
+    assert asyncio.run(reload("user")).code == 403
+    assert mock_hub.authenticator.allowed_headers == {"auth": "Remote-User"}
+    response = asyncio.run(reload("admin"))
+    assert response.code == 200
+    assert json.loads(response.body) == {
+        "allowed_headers": {"auth": "X-Remote-User"},
+        "header_parser_classes": {"auth": "Parser"},
+    }
+    assert mock_hub.authenticator.allowed_headers == {"auth": "X-Remote-User"}
+
+    config_file.write_text('c.HeaderAuthenticator.allowed_headers = {"data": "Data"}\n')
+    assert asyncio.run(reload("admin")).code == 400
+    assert mock_hub.authenticator.allowed_headers == {"auth": "X-Remote-User"}
+
+    # The endpoint isn't served unless enabled
+    mock_hub.authenticator.header_config_reload = False
+    assert asyncio.run(reload("admin")).code == 404
@@ -0,0 +1,737 @@
+import asyncio
+import json
+import logging
+import threading
+from types import SimpleNamespace
+import pytest
+from prometheus_client import REGISTRY
+from tornado.httputil import HTTPHeaders
+from jhubauthenticators import AsyncParser, Parser, JSONParser, RegexUsernameParser
+from jhubauthenticators._logging import LogRateLimiter
+from jhubauthenticators._ratelimit import TokenBucketLimiter
+from mock_hub import new_authenticator
+
+
+def test_extraction_plan_follows_allowed_headers():
+    """
+    Test that the extraction plan is compiled in the allowed_headers order
+    with the configured parsers
+    """
+    authenticator = new_authenticator(
+        allowed_headers={"auth": "Remote-User", "jsondata": "JsonData", "raw": "Raw"},
+        header_parser_classes={"auth": Parser, "jsondata": JSONParser},
+    )
+    plan = authenticator._extraction_plan
+    assert isinstance(plan, tuple)
+    assert [header for header, _, _, _, _ in plan] == ["Remote-User", "JsonData", "Raw"]
+    assert [state_key for _, _, state_key, _, _ in plan] == [
+        "Remote-User",
+        "JsonData",
+        "Raw",
+    ]
+    header_parsers = authenticator.header_parsers
+    assert plan[0][1] == header_parsers["auth"].parse
+    assert plan[1][1] == header_parsers["jsondata"].parse
+    assert plan[2][1] is None
+    assert [awaited for *_, awaited in plan] == [False, False, False]
+    async_plan = new_authenticator(
+        allowed_headers={"auth": "Remote-User", "lookup": "Lookup"},
+        header_parser_classes={"auth": Parser, "lookup": AsyncParser},
+    )._extraction_plan
+    assert [awaited for *_, awaited in async_plan] == [False, True]
+
+
+def test_extraction_plan_rebuilt_on_change():
+    """
+    Test that changing the traits recompiles the extraction plan
+    """
+    authenticator = new_authenticator()
+    authenticator.allowed_headers = {"auth": "X-User", "jsondata": "JsonData"}
+    assert [header for header, _, _, _, _ in authenticator._extraction_plan] == [
+        "X-User",
+        "JsonData",
+    ]
+    assert authenticator._extraction_plan[1][1] is None
+
+    authenticator.header_parser_classes = {"auth": Parser, "jsondata": JSONParser}
+    assert isinstance(authenticator.header_parsers["jsondata"], JSONParser)
+    assert authenticator._extraction_plan[1][1] == (
+        authenticator.header_parsers["jsondata"].parse
+    )
+
+
+def test_extraction_plan_rejects_duplicate_headers():
+    """
+    Test that a header listed under several allowed_headers keys is rejected,
+    since their parsed values would overwrite each other in the auth_state
+    """
+    with pytest.raises(ValueError):
+        new_authenticator(
+            allowed_headers={"auth": "Remote-User", "groups": "Remote-User"},
+        )
+    authenticator = new_authenticator()
+    with pytest.raises(ValueError):
+        authenticator.allowed_headers = {"auth": "X-User", "data": "X-User"}
+
+
+def test_authenticate_with_extraction_plan():
+    """
+    Test that authenticate produces the expected user model
+    """
+    authenticator = new_authenticator(
+        allowed_headers={"auth": "Remote-User", "jsondata": "JsonData", "raw": "Raw"},
+        header_parser_classes={"auth": Parser, "jsondata": JSONParser},
+    )
+    data = {"Remote-User": "my-username", "JsonData": '{"key": "value"}', "Raw": "x"}
+    user = asyncio.run(authenticator.authenticate(None, data))
+    assert user == {
+        "name": "my-username",
+        "auth_state": {"JsonData": {"key": "value"}, "Raw": data},
+    }
+
+
+def test_quiet_login_log_samples_login_line(caplog):
+    """
+    Test that the quiet_login_log mode only logs every n'th login INFO line
+    """
+    authenticator = new_authenticator(quiet_login_log=True, quiet_login_log_interval=10)
+    with caplog.at_level(logging.INFO, logger=authenticator.log.name):
+        for _ in range(25):
+            asyncio.run(authenticator.authenticate(None, {"Remote-User": "user"}))
+    login_lines = [
+        record for record in caplog.records if "Authenticated:" in record.getMessage()
+    ]
+    assert len(login_lines) == 3
+    assert "sampled 1 of 10 logins" in login_lines[-1].getMessage()
+
+
+def test_debug_messages_are_not_formatted_when_disabled(caplog):
+    """
+    Test that the authenticate debug messages don't stringify the data
+    when DEBUG is disabled
+    """
+
+    class NoStr(dict):
+        def __str__(self):
+            raise AssertionError("data was formatted")
+
+        __repr__ = __str__
+
+    authenticator = new_authenticator()
+    data = NoStr({"Remote-User": "user"})
+    with caplog.at_level(logging.WARNING, logger=authenticator.log.name):
+        user = asyncio.run(authenticator.authenticate(None, data))
+    assert user == {"name": "user"}
+
+
+def test_auth_result_cache():
+    """
+    Test that repeated logins with the same headers are served from the
+    authentication result cache without parsing the headers again
+    """
+    num_parsed = []
+
+    class CountingJSONParser(JSONParser):
+        def parse(self, data):
+            num_parsed.append(data)
+            return super().parse(data)
+
+    authenticator = new_authenticator(
+        allowed_headers={"auth": "Remote-User", "jsondata": "JsonData"},
+        header_parser_classes={"auth": Parser, "jsondata": CountingJSONParser},
+        auth_result_cache_size=10,
+    )
+
+    data = {"Remote-User": "my-username", "JsonData": '{"key": "value"}'}
+    first = asyncio.run(authenticator.authenticate(None, data))
+    # JupyterHub updates the returned dict
+    first["name"] = "changed"
+    first["auth_state"]["JsonData"] = "changed"
+    second = asyncio.run(authenticator.authenticate(None, data))
+    assert second == {
+        "name": "my-username",
+        "auth_state": {"JsonData": {"key": "value"}},
+    }
+    assert len(num_parsed) == 1
+    assert authenticator._auth_result_cache.hits == 1
+    # Nor do changes of the nested values, e.g. by a post_auth_hook
+    second["auth_state"]["JsonData"]["key"] = "changed"
+    third = asyncio.run(authenticator.authenticate(None, data))
+    assert third["auth_state"] == {"JsonData": {"key": "value"}}
+
+    other = asyncio.run(
+        authenticator.authenticate(None, {"Remote-User": "other-username"})
+    )
+    assert other == {"name": "other-username"}
+    assert authenticator._auth_result_cache.misses == 2
+
+
+def test_auth_result_cache_bypassed_without_parser():
+    authenticator = new_authenticator(
+        allowed_headers={"auth": "Remote-User", "raw": "Raw"},
+        header_parser_classes={"auth": Parser},
+        auth_result_cache_size=10,
+    )
+    data = {"Remote-User": "my-username", "Raw": "x"}
+    asyncio.run(authenticator.authenticate(None, data))
+    assert len(authenticator._auth_result_cache) == 0
+
+
+def test_auth_result_cache_memory_cap():
+    authenticator = new_authenticator(
+        auth_result_cache_size=10, auth_result_cache_max_bytes=100
+    )
+    for index in range(10):
+        asyncio.run(
+            authenticator.authenticate(
+                None, {"Remote-User": "user-{}-{}".format(index, "x" * 20)}
+            )
+        )
+    assert authenticator._auth_result_cache.weight <= 100
+    assert len(authenticator._auth_result_cache) == 1
+
+
+class MockAuthStateUser:
+    def __init__(self, name, auth_state):
+        self.name = name
+        self.auth_state = auth_state
+        self.decryptions = 0
+
+    async def get_auth_state(self):
+        self.decryptions += 1
+        # Give the other concurrent spawns a chance to start
+        await asyncio.sleep(0.01)
+        return dict(self.auth_state)
+
+
+class MockSpawner:
+    def __init__(self):
+        self.environment = {}
+
+
+def test_auth_state_cache_single_flight():
+    """
+    Test that concurrent spawns share a single auth_state decryption,
+    and that the cached auth_state is dropped when a new one is stored
+    """
+    authenticator = new_authenticator(
+        auth_state_cache_ttl=30, spawner_shared_headers=["Data"]
+    )
+    user = MockAuthStateUser("user", {"Data": "first"})
+
+    async def spawn_all(num_spawns):
+        spawners = [MockSpawner() for _ in range(num_spawns)]
+        await asyncio.gather(
+            *[authenticator.pre_spawn_start(user, spawner) for spawner in spawners]
+        )
+        return spawners
+
+    spawners = asyncio.run(spawn_all(10))
+    assert user.decryptions == 1
+    assert all(spawner.environment == {"Data": "first"} for spawner in spawners)
+
+    # Served from the cache
+    asyncio.run(spawn_all(2))
+    assert user.decryptions == 1
+
+    user.auth_state = {"Data": "second"}
+    authenticator.forget_cached_auth_state("user")
+    spawners = asyncio.run(spawn_all(5))
+    assert user.decryptions == 2
+    assert all(spawner.environment == {"Data": "second"} for spawner in spawners)
+
+
+def test_auth_state_cache_disabled():
+    authenticator = new_authenticator(spawner_shared_headers=["Data"])
+    user = MockAuthStateUser("user", {"Data": "first"})
+    for _ in range(3):
+        asyncio.run(authenticator.pre_spawn_start(user, MockSpawner()))
+    assert user.decryptions == 3
+
+
+def test_spawner_env_projection():
+    """
+    Test that the spawner_env_projection only shares the projected
+    auth_state values, JSON encoded and limited in size
+    """
+    authenticator = new_authenticator(
+        spawner_shared_headers=["StringData"],
+        spawner_env_projection={
+            "JsonData/claims/email": "USER_EMAIL",
+            "JsonData/groups": "USER_GROUPS",
+            "JsonData/groups/1": "USER_SECOND_GROUP",
+            "JsonData/missing": "MISSING",
+            "JsonData/large": "LARGE",
+        },
+        spawner_env_max_value_size=64,
+    )
+    user = MockAuthStateUser(
+        "user",
+        {
+            "StringData": "string",
+            "JsonData": {
+                "claims": {"email": "user@example.com"},
+                "groups": ["first", "second"],
+                "large": "x" * 65,
+            },
+        },
+    )
+    spawner = MockSpawner()
+    asyncio.run(authenticator.pre_spawn_start(user, spawner))
+    assert spawner.environment == {
+        "StringData": "string",
+        "USER_EMAIL": "user@example.com",
+        "USER_GROUPS": '["first","second"]',
+        "USER_SECOND_GROUP": "second",
+    }
+
+
+def test_auth_state_compression():
+    """
+    Test that the auth_state values above the threshold are stored compressed
+    and that both compressed and uncompressed auth_state is read by pre_spawn_start
+    """
+    authenticator = new_authenticator(
+        allowed_headers={"auth": "Remote-User", "jsondata": "JsonData", "raw": "Raw"},
+        header_parser_classes={"auth": Parser, "jsondata": JSONParser, "raw": Parser},
+        auth_state_compression_threshold=256,
+        spawner_shared_headers=["Raw"],
+        spawner_env_projection={"JsonData/groups/99": "LAST_GROUP"},
+    )
+    groups = {"groups": ["group-{}".format(index) for index in range(100)]}
+    data = {
+        "Remote-User": "user",
+        "JsonData": json.dumps(groups),
+        "Raw": "zlib+json:not-compressed",
+    }
+    user = asyncio.run(authenticator.authenticate(None, data))
+    auth_state = user["auth_state"]
+    # The spoofed prefix is compressed even below the threshold
+    assert auth_state["Raw"] != data["Raw"]
+    assert auth_state["JsonData"].startswith("zlib+json:")
+    assert len(auth_state["JsonData"]) < len(data["JsonData"]) / 2
+
+    assert authenticator.decompress_auth_state(auth_state) == {
+        "JsonData": groups,
+        "Raw": "zlib+json:not-compressed",
+    }
+    spawner = MockSpawner()
+    asyncio.run(
+        authenticator.pre_spawn_start(MockAuthStateUser("user", auth_state), spawner)
+    )
+    assert spawner.environment == {
+        "Raw": "zlib+json:not-compressed",
+        "LAST_GROUP": "group-99",
+    }
+
+    # The auth_state that was stored uncompressed is read as is
+    authenticator.auth_state_compression_threshold = 0
+    state = {"JsonData": groups, "Raw": "raw"}
+    assert authenticator.decompress_auth_state(state) is state
+    spawner = MockSpawner()
+    asyncio.run(
+        authenticator.pre_spawn_start(MockAuthStateUser("user", state), spawner)
+    )
+    assert spawner.environment == {"Raw": "raw", "LAST_GROUP": "group-99"}
+    user = asyncio.run(authenticator.authenticate(None, data))
+    assert user["auth_state"]["JsonData"] == groups
+
+
+def test_parser_offload_threshold():
+    """
+    Test that only header values above the parser_offload_threshold
+    are parsed in the parser thread pool
+    """
+    parse_threads = {}
+
+    class ThreadRecordingJSONParser(JSONParser):
+        def parse(self, data):
+            parse_threads[len(data)] = threading.current_thread().name
+            return super().parse(data)
+
+    authenticator = new_authenticator(
+        allowed_headers={"auth": "Remote-User", "jsondata": "JsonData"},
+        header_parser_classes={"auth": Parser, "jsondata": ThreadRecordingJSONParser},
+        parser_offload_threshold=1024,
+    )
+    small = json.dumps({"groups": ["a"]})
+    large = json.dumps({"groups": ["group-{}".format(i) for i in range(200)]})
+    for payload in (small, large):
+        user = asyncio.run(
+            authenticator.authenticate(
+                None, {"Remote-User": "user", "JsonData": payload}
+            )
+        )
+        assert user["auth_state"]["JsonData"] == json.loads(payload)
+
+    assert parse_threads[len(small)] == threading.current_thread().name
+    assert parse_threads[len(large)].startswith("jhubauthenticators-parser")
+    metrics = authenticator.parser_executor_metrics
+    assert metrics["offloaded"] == 1
+    # The auth header and the small JSON header
+    assert metrics["inline"] == 3
+    assert metrics["queue_depth"] == 0
+    assert metrics["max_queue_depth"] == 1
+    assert metrics["parse_time"] > 0
+
+
+def test_log_rate_limiter():
+    now = [0.0]
+    limiter = LogRateLimiter(10.0, timer=lambda: now[0])
+    assert limiter.acquire() == 0
+    assert limiter.acquire() is None
+    assert limiter.acquire() is None
+    now[0] = 10.0
+    assert limiter.acquire() == 2
+    assert limiter.acquire() is None
+    assert limiter.total_suppressed == 3
+
+
+def test_token_bucket_limiter():
+    now = [0.0]
+    limiter = TokenBucketLimiter(2.0, 3, max_keys=2, timer=lambda: now[0])
+    assert [limiter.acquire("a") for _ in range(3)] == [0, 0, 0]
+    assert limiter.acquire("a") == 0.5
+    assert limiter.acquire("b") == 0
+    now[0] = 0.5
+    assert limiter.acquire("a") == 0
+    assert limiter.acquire("a") == 0.5
+    assert limiter.limited == 2
+    # Idle buckets are full again and are evicted
+    now[0] = 2.0
+    assert limiter.acquire("c") == 0
+    assert len(limiter) == 2
+    assert [limiter.acquire("a") for _ in range(3)] == [0, 0, 0]
+
+
+def test_pre_spawn_start_metrics():
+    name = "jupyterhub_header_pre_spawn_start_duration_seconds_count"
+    before = REGISTRY.get_sample_value(name)
+    authenticator = new_authenticator()
+    spawner = MockSpawner()
+    asyncio.run(authenticator.pre_spawn_start(MockAuthStateUser("user", {}), spawner))
+    assert REGISTRY.get_sample_value(name) == before + 1
+
+
+async def authenticate_each(authenticator, header_maps):
+    results = []
+    for data in header_maps:
+        try:
+            results.append(await authenticator.authenticate(None, data))
+        except Exception as err:
+            results.append(err)
+    return results
+
+
+async def collect(async_iterable):
+    return [result async for result in async_iterable]
+
+
+def describe(result):
+    if isinstance(result, Exception):
+        return (type(result), str(result))
+    return result
+
+
+def test_authenticate_many():
+    """
+    Test that authenticate_many yields the same results as authenticate,
+    in order, while identical header values are only parsed once per batch
+    """
+    num_parsed = []
+
+    class CountingJSONParser(JSONParser):
+        def parse(self, data):
+            num_parsed.append(data)
+            return super().parse(data)
+
+    authenticator = new_authenticator(
+        allowed_headers={"auth": "Remote-User", "jsondata": "JsonData", "raw": "Raw"},
+        header_parser_classes={"auth": Parser, "jsondata": CountingJSONParser},
+    )
+    header_maps = [
+        {"Remote-User": "user-{}".format(index % 3), "JsonData": '{"key": "value"}'}
+        for index in range(10)
+    ] + [
+        {"Remote-User": "user", "JsonData": "not json"},
+        {"JsonData": '{"key": "value"}'},
+        {"Remote-User": "user", "Raw": "raw"},
+        {"Remote-User": "user", "JsonData": "null"},
+    ]
+    expected = asyncio.run(authenticate_each(authenticator, header_maps))
+    num_parsed.clear()
+    results = asyncio.run(
+        collect(authenticator.authenticate_many(iter(header_maps), batch_size=6))
+    )
+    assert [describe(result) for result in results] == [
+        describe(result) for result in expected
+    ]
+    # Once in each of the two batches of 6 that have the value
+    assert num_parsed.count('{"key": "value"}') == 2
+    # The user models don't share the parsed values
+    results[0]["auth_state"]["JsonData"]["key"] = "changed"
+    assert results[1]["auth_state"]["JsonData"] == {"key": "value"}
+    assert isinstance(results[10], json.JSONDecodeError)
+    assert results[11].status_code == 401
+    assert results[12]["auth_state"]["Raw"] is header_maps[12]
+
+
+def refresh_handler(headers, current_user=None):
+    return SimpleNamespace(
+        request=SimpleNamespace(headers=HTTPHeaders(headers)),
+        _jupyterhub_user=current_user,
+    )
+
+
+def refresh_authenticator(**traits):
+    """A HeaderAuthenticator with a JsonData header, that records the headers
+    of every _prepare_user call in its parses list"""
+    authenticator = new_authenticator(
+        allowed_headers={"auth": "Remote-User", "jsondata": "JsonData"},
+        header_parser_classes={"auth": Parser, "jsondata": JSONParser},
+        **traits,
+    )
+    authenticator.parses = []
+    prepare_user = authenticator._prepare_user
+
+    async def counting_prepare_user(plan, data, handler=None, login=True):
+        authenticator.parses.append(data)
+        return await prepare_user(plan, data, handler, login)
+
+    authenticator._prepare_user = counting_prepare_user
+    return authenticator
+
+
+def test_refresh_user():
+    """
+    Test that refresh_user only parses the headers again when their values
+    have changed since the last refresh, and rejects headers of another user
+    """
+    authenticator = refresh_authenticator()
+    parses = authenticator.parses
+    headers = {"Remote-User": "user", "JsonData": '{"groups": ["a"]}'}
+    authenticated = asyncio.run(authenticator.authenticate(None, headers))
+    assert len(parses) == 1
+
+    user = MockAuthStateUser("user", authenticated["auth_state"])
+    refresh = authenticator.refresh_user
+    # The digest isn't computed on login, so the first refresh compares
+    # the parsed headers with the stored auth_state
+    assert asyncio.run(refresh(user, refresh_handler(headers))) is True
+    assert len(parses) == 2
+    assert asyncio.run(refresh(user, refresh_handler(headers))) is True
+    assert asyncio.run(refresh(user, None)) is True
+    assert asyncio.run(refresh(user, refresh_handler({}))) is True
+    assert len(parses) == 2
+
+    changed = dict(headers, JsonData='{"groups": ["a", "b"]}')
+    assert asyncio.run(refresh(user, refresh_handler(changed))) == {
+        "name": "user",
+        "auth_state": {"JsonData": {"groups": ["a", "b"]}},
+    }
+    assert len(parses) == 3
+    assert asyncio.run(refresh(user, refresh_handler(changed))) is True
+    assert len(parses) == 3
+
+    other = dict(changed, **{"Remote-User": "other"})
+    assert asyncio.run(refresh(user, refresh_handler(other))) is False
+
+
+def test_refresh_user_reuses_result_cache_digest():
+    """
+    Test that a login through the result cache records the digest,
+    such that the first refresh with the same headers doesn't parse them
+    """
+    authenticator = refresh_authenticator(auth_result_cache_size=10)
+    headers = {"Remote-User": "user", "JsonData": '{"groups": ["a"]}'}
+    authenticated = asyncio.run(authenticator.authenticate(None, headers))
+    user = MockAuthStateUser("user", authenticated["auth_state"])
+    assert asyncio.run(authenticator.refresh_user(user, refresh_handler(headers)))
+    assert len(authenticator.parses) == 1
+    assert user.decryptions == 0
+
+
+def test_refresh_user_clears_auth_state():
+    """
+    Test that the auth_state is cleared when the changed headers
+    no longer produce one
+    """
+    authenticator = refresh_authenticator()
+    headers = {"Remote-User": "user", "JsonData": '{"groups": ["admins"]}'}
+    authenticated = asyncio.run(authenticator.authenticate(None, headers))
+    user = MockAuthStateUser("user", authenticated["auth_state"])
+    refreshed = asyncio.run(
+        authenticator.refresh_user(user, refresh_handler({"Remote-User": "user"}))
+    )
+    assert refreshed == {"name": "user", "auth_state": None}
+
+
+def test_refresh_user_for_another_user():
+    """
+    Test that a refresh of a request by another user, e.g. an admin that
+    spawns or stops the user's server, keeps the user's auth_state
+    """
+    authenticator = refresh_authenticator()
+    user = MockAuthStateUser("alice", {"JsonData": {"groups": ["a"]}})
+    handler = refresh_handler(
+        {"Remote-User": "admin"}, current_user=SimpleNamespace(name="admin")
+    )
+    assert asyncio.run(authenticator.refresh_user(user, handler)) is True
+    assert authenticator.parses == []
+    own = refresh_handler({"Remote-User": "admin"}, current_user=user)
+    assert asyncio.run(authenticator.refresh_user(user, own)) is False
+
+
+def test_refresh_user_not_a_login_failure():
+    name = "jupyterhub_header_login_failures_total"
+    labels = {"reason": "missing_username"}
+    before = REGISTRY.get_sample_value(name, labels) or 0
+
+    class RejectingParser(Parser):
+        def parse(self, data):
+            return None
+
+    authenticator = new_authenticator(header_parser_classes={"auth": RejectingParser})
+    user = MockAuthStateUser("user", {})
+    handler = refresh_handler({"Remote-User": "user"})
+    assert asyncio.run(authenticator.refresh_user(user, handler)) is False
+    assert (REGISTRY.get_sample_value(name, labels) or 0) == before
+
+
+RELOAD_CONFIG = """
+from jhubauthenticators import JSONParser, RegexUsernameParser
+
+c.HeaderAuthenticator.allowed_headers = {
+    "auth": "X-Remote-User",
+    "jsondata": "JsonData",
+}
+c.HeaderAuthenticator.header_parser_classes = {
+    "auth": RegexUsernameParser,
+    "jsondata": JSONParser,
+}
+c.HeaderAuthenticator.spawner_shared_headers = ["JsonData"]
+c.RegexUsernameParser.username_extract_regex = "user=([^;]+)"
+c.JSONParser.projection = ["sub"]
+# Not reloadable
+c.HeaderAuthenticator.login_rate_limit = 5.0
+"""
+
+
+def write_config(tmp_path, content):
+    config_file = tmp_path / "jupyterhub_config.py"
+    config_file.write_text(content)
+    return str(config_file)
+
+
+def test_reload_header_config(tmp_path):
+    authenticator = new_authenticator(
+        header_config_file=write_config(tmp_path, RELOAD_CONFIG)
+    )
+    authenticator.reload_header_config()
+    assert authenticator.allowed_headers["auth"] == "X-Remote-User"
+    assert authenticator.spawner_shared_headers == ["JsonData"]
+    assert authenticator.login_rate_limit == 0
+    assert [header for header, _, _, _, _ in authenticator._extraction_plan] == [
+        "X-Remote-User",
+        "JsonData",
+    ]
+    data = {
+        "X-Remote-User": "dn;user=my-user;",
+        "JsonData": '{"sub": "my-user", "groups": ["a"]}',
+    }
+    user = asyncio.run(authenticator.authenticate(None, data))
+    assert user == {"name": "my-user", "auth_state": {"JsonData": {"sub": "my-user"}}}
+
+    # The parser config is reloaded even when the classes are unchanged
+    write_config(tmp_path, RELOAD_CONFIG.replace('["sub"]', '["groups"]'))
+    authenticator.reload_header_config()
+    user = asyncio.run(authenticator.authenticate(None, data))
+    assert user["auth_state"] == {"JsonData": {"groups": ["a"]}}
+
+    # A parser section that is removed from the file is reset
+    write_config(
+        tmp_path, RELOAD_CONFIG.replace('c.JSONParser.projection = ["sub"]', "")
+    )
+    authenticator.reload_header_config()
+    user = asyncio.run(authenticator.authenticate(None, data))
+    assert user["auth_state"] == {"JsonData": {"sub": "my-user", "groups": ["a"]}}
+
+
+def test_reload_header_config_builds_parsers_once(tmp_path, monkeypatch):
+    authenticator = new_authenticator(
+        header_config_file=write_config(tmp_path, RELOAD_CONFIG)
+    )
+    built = []
+    new_header_parsers = authenticator._new_header_parsers
+
+    def counting_new_header_parsers(*args, **kwargs):
+        built.append(args)
+        return new_header_parsers(*args, **kwargs)
+
+    monkeypatch.setattr(
+        authenticator, "_new_header_parsers", counting_new_header_parsers
+    )
+    authenticator.reload_header_config()
+    assert len(built) == 1
+    assert {
+        parser_key: type(parser)
+        for parser_key, parser in authenticator.header_parsers.items()
+    } == {"auth": RegexUsernameParser, "jsondata": JSONParser}
+
+
+@pytest.mark.parametrize(
+    "content",
+    [
+        RELOAD_CONFIG.replace('"auth": "X-Remote-User",', ""),
+        RELOAD_CONFIG.replace("user=([^;]+)", "user=(invalid"),
+        RELOAD_CONFIG.replace('"jsondata": JSONParser', '"jsondata": dict'),
+        RELOAD_CONFIG.replace('["JsonData"]', '"JsonData"'),
+        RELOAD_CONFIG + "syntax error",
+    ],
+)
+def test_reload_header_config_failure(tmp_path, content):
+    """
+    Test that a failed reload keeps the previous configuration
+    """
+    authenticator = new_authenticator(
+        header_config_file=write_config(tmp_path, content)
+    )
+    plan = authenticator._extraction_plan
+    parsers = authenticator.header_parsers
+    with pytest.raises(Exception):
+        authenticator.reload_header_config()
+    assert authenticator._extraction_plan is plan
+    assert authenticator.header_parsers is parsers
+    assert authenticator.allowed_headers == {"auth": "Remote-User"}
+    user = asyncio.run(authenticator.authenticate(None, {"Remote-User": "user"}))
+    assert user == {"name": "user"}
+
+
+def test_reload_header_config_inflight_login(tmp_path):
+    """
+    Test that a login that is in-flight during a reload
+    completes with the plan that it started with
+    """
+
+    class WaitingParser(AsyncParser):
+        async def parse(self, data):
+            await reloaded.wait()
+            return data
+
+    async def login_during_reload():
+        authenticator = new_authenticator(
+            allowed_headers={"auth": "Remote-User", "data": "Data"},
+            header_parser_classes={"auth": Parser, "data": WaitingParser},
+            header_config_file=write_config(tmp_path, RELOAD_CONFIG),
+        )
+        data = {"Remote-User": "user", "Data": "value", "X-Remote-User": "user=other"}
+        login = asyncio.ensure_future(authenticator.authenticate(None, data))
+        await asyncio.sleep(0.01)
+        authenticator.reload_header_config()
+        reloaded.set()
+        return await login, await authenticator.authenticate(None, data)
+
+    reloaded = asyncio.Event()
+    inflight, after = asyncio.run(login_during_reload())
+    assert inflight == {"name": "user", "auth_state": {"Data": "value"}}
+    assert after == {"name": "other"}
@@ -0,0 +1,60 @@
+import asyncio
+import json
+from traitlets.config import Config
+from jhubauthenticators import HeaderAuthenticator
+from jhubauthenticators._loadgen import LoadGenerator, load_corpus, percentile
+from mock_hub import MockHub, MockHubServer
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 95) == 95
+    assert percentile(values, 99) == 99
+    assert percentile([7], 99) == 7
+    assert percentile([], 50) is None
+
+
+def test_load_corpus(tmp_path):
+    corpus = tmp_path / "corpus.jsonl"
+    corpus.write_text(
+        "\n".join(
+            [
+                json.dumps({"Remote-User": "user-0"}),
+                "",
+                json.dumps(
+                    {"headers": {"Remote-User": "user-1"}, "user_data": {"data": 1}}
+                ),
+            ]
+        )
+    )
+    assert load_corpus(str(corpus)) == [
+        ({"Remote-User": "user-0"}, None),
+        ({"Remote-User": "user-1"}, {"data": 1}),
+    ]
+
+
+def test_load_generator(monkeypatch):
+    config = Config()
+    config.HeaderAuthenticator.allow_all = True
+    config.HeaderAuthenticator.user_external_allow_attributes = ["data"]
+    mock_hub = MockHub(HeaderAuthenticator(config=config))
+    mock_hub.patch(monkeypatch)
+    records = [
+        ({"Remote-User": "user-{}".format(index)}, {"data": index})
+        for index in range(3)
+    ] + [({}, None)]
+
+    async def generate():
+        async with MockHubServer(mock_hub) as server:
+            return await LoadGenerator(server.url, records, 4, 20).run()
+
+    report = asyncio.run(generate())
+    login = report["endpoints"]["login"]
+    assert login["requests"] == 20
+    assert login["statuses"] == {"302": 15, "401": 5}
+    user_data = report["endpoints"]["set-user-data"]
+    assert user_data["statuses"] == {"200": 15}
+    latency = user_data["latency_seconds"]
+    assert 0 < latency["p50"] <= latency["p95"] <= latency["p99"] <= latency["max"]
+    assert mock_hub.users["user-2"].data == 2
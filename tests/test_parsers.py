@@ -0,0 +1,387 @@
+import asyncio
+import json
+import textwrap
+import time
+import pytest
+from tornado import web
+from tornado.httpserver import HTTPServer
+from tornado.testing import bind_unused_port
+from traitlets.config import Config
+from jhubauthenticators import (
+    CompressedJSONParser,
+    HeaderAuthenticator,
+    HTTPLookupParser,
+    JSONParser,
+    Parser,
+    RegexUsernameParser,
+    compile_replace_chars,
+)
+from jhubauthenticators._cache import LRUCache
+from jhubauthenticators._compression import compress
+
+EMAIL_REGEX = r"([a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+)"
+
+
+def new_parser(parser_class, **traits):
+    config = Config()
+    for trait_key, trait_val in traits.items():
+        setattr(config[parser_class.__name__], trait_key, trait_val)
+    return parser_class(config=config)
+
+
+@pytest.mark.parametrize(
+    "replace_chars",
+    [
+        {"@": "_", ".": "_"},
+        {"@": "_", "_": "-"},
+        {"@": "-at-", ".": "_"},
+        {"@.": "_"},
+    ],
+)
+def test_compile_replace_chars_matches_sequential_replace(replace_chars):
+    """
+    Test that the compiled replacement produces the same result as
+    replacing each key in order
+    """
+    value = "first.last_name@mail.example.com"
+    expected = value
+    for replace_key, replace_val in replace_chars.items():
+        expected = expected.replace(replace_key, replace_val)
+    assert compile_replace_chars(replace_chars)(value) == expected
+
+
+def test_regex_username_parser_replace():
+    parser = new_parser(
+        RegexUsernameParser,
+        username_extract_regex=EMAIL_REGEX,
+        replace_extract_chars={"@": "_", ".": "_"},
+    )
+    assert parser.parse("mail@sdfsf.com") == "mail_sdfsf_com"
+    assert parser.parse("not an email") is None
+
+
+def test_regex_username_parser_cache():
+    """
+    Test that repeated header values are served from the cache
+    """
+    parser = new_parser(
+        RegexUsernameParser,
+        username_extract_regex=EMAIL_REGEX,
+        replace_extract_chars={"@": "_", ".": "_"},
+        cache_size=2,
+    )
+    assert parser.parse("mail@sdfsf.com") == "mail_sdfsf_com"
+    assert parser.parse("mail@sdfsf.com") == "mail_sdfsf_com"
+    assert parser.cache_hits == 1
+    assert parser.cache_misses == 1
+    # Cache hits are counted against the pattern that matched
+    assert parser.pattern_match_counts == {EMAIL_REGEX: 2}
+
+    # Failed parses are not cached
+    assert parser.parse("not an email") is None
+    assert parser.parse("not an email") is None
+    assert parser.cache_misses == 3
+
+    # Changing the configuration invalidates the cache
+    parser.replace_extract_chars = {"@": "-"}
+    assert parser.parse("mail@sdfsf.com") == "mail-sdfsf.com"
+    assert parser.cache_hits == 0
+
+
+def test_regex_username_parser_without_cache():
+    parser = new_parser(RegexUsernameParser, username_extract_regex=EMAIL_REGEX)
+    assert parser.parse("mail@sdfsf.com") == "mail@sdfsf.com"
+    assert parser.cache_hits == 0
+    assert parser.cache_misses == 0
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(max_size=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert "b" not in cache
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.info()["size"] == 2
+
+
+def test_lru_cache_ttl():
+    now = [0.0]
+    cache = LRUCache(max_size=2, ttl=10, timer=lambda: now[0])
+    cache.set("a", 1)
+    now[0] = 9.0
+    assert cache.get("a") == 1
+    now[0] = 10.0
+    assert cache.get("a") is None
+    assert cache.hits == 1
+    assert cache.misses == 1
+
+
+def test_regex_username_parser_multiple_patterns():
+    """
+    Test that the first matching pattern in the list is used, with its own
+    replace rules, and that the matches are counted per pattern
+    """
+    parser = new_parser(
+        RegexUsernameParser,
+        username_extract_patterns=[
+            {
+                "name": "email",
+                "regex": EMAIL_REGEX,
+                "replace_extract_chars": {"@": "_", ".": "_"},
+            },
+            {"name": "x509", "regex": r"(?i)/CN=([^/]+)"},
+            {"name": "oidc", "regex": r"^oidc\|(\w+)$"},
+        ],
+        replace_extract_chars={" ": "-"},
+    )
+    # The email pattern has priority even though the CN comes first
+    assert parser.parse("/cn=Jane Doe/emailAddress=jane@doe.org") == "jane_doe_org"
+    assert parser.parse("/O=Org/CN=Jane Doe") == "Jane-Doe"
+    assert parser.parse("oidc|abc123") == "abc123"
+    assert parser.parse("unknown") is None
+    assert parser.pattern_match_counts == {"email": 1, "x509": 1, "oidc": 1}
+
+
+def test_regex_username_parser_pattern_group_errors():
+    parser = new_parser(
+        RegexUsernameParser,
+        username_extract_patterns=[
+            {"name": "nogroup", "regex": r"^nogroup$"},
+            {"name": "twogroups", "regex": r"(\w+)-(\w+)"},
+        ],
+    )
+    assert parser.parse("nogroup") is None
+    assert parser.parse("first-second") is None
+    assert parser.pattern_match_counts == {"nogroup": 1, "twogroups": 1}
+
+
+def test_regex_username_parser_invalid_pattern():
+    with pytest.raises(ValueError):
+        new_parser(RegexUsernameParser, username_extract_patterns=[{"name": "empty"}])
+
+
+class LookupHandler(web.RequestHandler):
+    """Local stand-in for a user mapping service, which counts the maximum
+    number of lookups that were in flight at the same time"""
+
+    in_flight = 0
+    max_in_flight = 0
+
+    async def get(self, name):
+        cls = type(self)
+        cls.in_flight += 1
+        cls.max_in_flight = max(cls.max_in_flight, cls.in_flight)
+        try:
+            await asyncio.sleep(float(self.get_argument("delay", "0")))
+        finally:
+            cls.in_flight -= 1
+        if name == "missing":
+            raise web.HTTPError(404)
+        self.write({"name": name, "groups": ["group-" + name]})
+
+
+async def start_lookup_server():
+    sock, port = bind_unused_port()
+    server = HTTPServer(web.Application([(r"/users/([^/]+)", LookupHandler)]))
+    server.add_sockets([sock])
+    return server, "http://127.0.0.1:{}".format(port)
+
+
+def test_http_lookup_parser():
+    async def lookup():
+        server, url = await start_lookup_server()
+        parser = new_parser(HTTPLookupParser, lookup_url=url + "/users/{value}")
+        try:
+            return (
+                await parser.parse("my user"),
+                await parser.parse("missing"),
+            )
+        finally:
+            server.stop()
+
+    found, missing = asyncio.run(lookup())
+    assert found == {"name": "my user", "groups": ["group-my user"]}
+    assert missing is None
+
+
+def test_async_parsers_run_concurrently():
+    """
+    Test that the HeaderAuthenticator runs the async parsers of a request
+    concurrently and abandons those that exceed their timeout
+    """
+
+    class SlowLookupParser(HTTPLookupParser):
+        pass
+
+    class TimeoutLookupParser(HTTPLookupParser):
+        pass
+
+    async def authenticate():
+        server, url = await start_lookup_server()
+        config = Config()
+        config.HeaderAuthenticator.allowed_headers = {
+            "auth": "Remote-User",
+            "first": "First",
+            "second": "Second",
+            "timeout": "Timeout",
+        }
+        config.HeaderAuthenticator.header_parser_classes = {
+            "auth": Parser,
+            "first": SlowLookupParser,
+            "second": SlowLookupParser,
+            "timeout": TimeoutLookupParser,
+        }
+        config.SlowLookupParser.lookup_url = url + "/users/{value}?delay=0.3"
+        config.TimeoutLookupParser.lookup_url = url + "/users/{value}?delay=2"
+        config.TimeoutLookupParser.timeout = 0.1
+        authenticator = HeaderAuthenticator(config=config)
+        data = {
+            "Remote-User": "user",
+            "First": "first",
+            "Second": "second",
+            "Timeout": "timeout",
+        }
+        try:
+            return await authenticator.authenticate(None, data)
+        finally:
+            server.stop()
+
+    LookupHandler.in_flight = LookupHandler.max_in_flight = 0
+    user = asyncio.run(authenticate())
+    assert user == {
+        "name": "user",
+        "auth_state": {
+            "First": {"name": "first", "groups": ["group-first"]},
+            "Second": {"name": "second", "groups": ["group-second"]},
+        },
+    }
+    # Every lookup was started before any of them finished
+    assert LookupHandler.max_in_flight == 3
+
+
+@pytest.mark.parametrize("compression", ["zlib", "deflate", "gzip"])
+def test_compressed_json_parser(compression):
+    payload = {
+        "sub": "my-username",
+        "groups": ["group-{}".format(i) for i in range(50)],
+    }
+    encoded = compress(json.dumps(payload).encode(), compression=compression)
+    parser = new_parser(CompressedJSONParser, compression=compression)
+    assert parser.parse(encoded) == payload
+    # Plain JSON is accepted as is
+    assert parser.parse(json.dumps(payload)) == payload
+    assert (
+        new_parser(CompressedJSONParser, allow_uncompressed=False).parse(
+            json.dumps(payload)
+        )
+        is None
+    )
+
+
+def test_compressed_json_parser_chunks():
+    """
+    Test that a payload split at arbitrary offsets across
+    numbered headers is reassembled
+    """
+    payload = {"groups": ["group-{}".format(i) for i in range(500)]}
+    encoded = compress(json.dumps(payload).encode())
+    parser = new_parser(CompressedJSONParser)
+    for size in (1, 5, 64, 333):
+        chunks = textwrap.wrap(encoded, size)
+        data = {"JsonData-{}".format(i + 1): chunk for i, chunk in enumerate(chunks)}
+        if len(chunks) > parser.max_chunks:
+            # The payload is truncated by the max_chunks limit
+            assert parser.parse(parser.extract(data, "JsonData")) is None
+            continue
+        assert parser.extract(data, "JsonData") == tuple(chunks)
+        assert parser.parse(parser.extract(data, "JsonData")) == payload
+    # The header itself takes precedence over the numbered headers
+    assert parser.extract({"JsonData": "value", "JsonData-1": "a"}, "JsonData") == (
+        "value"
+    )
+    assert parser.extract({}, "JsonData") == ()
+
+
+def test_compressed_json_parser_size_limit():
+    """
+    Test that payloads that decompress to more than the limit are rejected
+    without decompressing them in full
+    """
+    bomb = compress(b"[" + b" " * (64 * 1024 * 1024) + b"]", level=9)
+    assert len(bomb) < 128 * 1024
+    parser = new_parser(CompressedJSONParser, max_decompressed_size=1024)
+    start = time.perf_counter()
+    assert parser.parse(bomb) is None
+    assert time.perf_counter() - start < 0.5
+    assert new_parser(CompressedJSONParser).parse(compress(b"[1, 2]")) == [1, 2]
+    # Invalid, truncated and trailing data
+    assert parser.parse("not base64 zlib") is None
+    assert parser.parse(compress(b"[1, 2]")[:-4]) is None
+    assert parser.parse(compress(b"[1]") + compress(b"[2]")) is None
+
+
+def test_authenticate_compressed_json_chunks():
+    payload = {"groups": ["group-{}".format(i) for i in range(100)]}
+    encoded = compress(json.dumps(payload).encode())
+    config = Config()
+    config.HeaderAuthenticator.allowed_headers = {
+        "auth": "Remote-User",
+        "jsondata": "JsonData",
+    }
+    config.HeaderAuthenticator.header_parser_classes = {
+        "auth": Parser,
+        "jsondata": CompressedJSONParser,
+    }
+    authenticator = HeaderAuthenticator(config=config)
+    data = {
+        "Remote-User": "user",
+        "JsonData-1": encoded[:100],
+        "JsonData-2": encoded[100:],
+    }
+    user = asyncio.run(authenticator.authenticate(None, data))
+    assert user == {"name": "user", "auth_state": {"JsonData": payload}}
+    results = asyncio.run(collect(authenticator.authenticate_many([data, data])))
+    assert results == [user, user]
+    assert authenticator.login_key(data) != authenticator.login_key(
+        {"Remote-User": "user", "JsonData-1": encoded[:100]}
+    )
+
+
+async def collect(results):
+    return [result async for result in results]
+
+
+def test_json_parser_projection():
+    payload = {
+        "sub": "my-username",
+        "groups": ["a", "b"],
+        "claims": {"email": "user@example.org", "name": "My User", "a/b": 1},
+        "idp": {"issuer": "https://idp.example.org"},
+    }
+    parser = new_parser(
+        JSONParser, projection=["sub", "/claims/email", "/claims/a~1b", "/missing/key"]
+    )
+    assert parser.parse(json.dumps(payload)) == {
+        "sub": "my-username",
+        "claims": {"email": "user@example.org", "a/b": 1},
+    }
+    # A shorter pointer keeps the whole value, arrays are kept whole
+    parser.projection = ["/claims/email", "/claims", "/groups/0"]
+    assert parser.parse(json.dumps(payload)) == {
+        "claims": payload["claims"],
+        "groups": ["a", "b"],
+    }
+    # The empty pointer or list keeps the whole document
+    parser.projection = [""]
+    assert parser.parse(json.dumps(payload)) == payload
+    parser.projection = []
+    assert parser.parse(json.dumps(payload)) == payload
+    assert parser.parse('["sub"]') == ["sub"]
+
+    compressed = new_parser(CompressedJSONParser, projection=["sub"])
+    assert compressed.parse(compress(json.dumps(payload).encode())) == {
+        "sub": "my-username"
+    }